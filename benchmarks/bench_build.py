@@ -0,0 +1,224 @@
+# coding: utf-8
+
+"""
+Build benchmarks on synthetic blogs (see synthetic.py).
+
+For each blog size, generates a blog in a temporary directory and times:
+
+    full        build from scratch
+    noop        build again, with no changes
+    post        build after editing one post
+    template    build after editing one template
+    rss         generate the feeds (forced)
+
+Every build runs in a new process, as ristretto does.  Reports wall time,
+peak memory (max. RSS) and files and bytes written by each build.
+
+Usage:
+    python benchmarks/bench_build.py [options]
+
+    --sizes=N,N...      numbers of posts (default 1000,10000,50000)
+    --jobs=N            render using N processes (default 1)
+    --template=NAME     template edited by the template scenario
+                        (default permalink.html)
+    --json=FILE         also write results to FILE
+    --keep              keep the generated blogs
+
+Other options (--paragraphs, --code, --tags...) are passed to the blog
+generator.
+"""
+
+import os
+import sys
+import json
+import time
+import getopt
+import shutil
+import tempfile
+import resource
+import subprocess
+
+import synthetic
+
+
+RISTRETTO_DIR = os.path.join(synthetic.REPO_DIR, 'ristretto')
+
+SCENARIOS = ['full', 'noop', 'post', 'template', 'rss']
+
+
+def run_build(base_dir, scenario, jobs):
+    """
+    Runs in the benchmark's child process: builds the blog in base_dir and
+    prints results as json.
+    """
+    sys.path.insert(0, RISTRETTO_DIR)
+    sys.path.insert(0, base_dir)
+    os.chdir(base_dir)
+
+    import logging
+    import shared
+    shared.blog_settings = synthetic.SETTINGS_MODULE
+    import base_settings as settings
+    import updater
+
+    logging.basicConfig(filename=settings.LOG_FILE, level=logging.INFO, format='%(asctime)s %(message)s')
+
+    start = time.time()
+
+    u = updater.Updater(settings=settings, jobs=jobs)
+    if scenario == 'rss':
+        u.load_corpus()
+        u.publish_rss(force_publish=True)
+    else:
+        u.update()
+
+    wall = time.time() - start
+
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+    print json.dumps({
+        'wall': wall,
+        'peak_rss': peak * 1024,   # ru_maxrss is in KB
+        'files': len(u.writer.changed),
+        'bytes': u.writer.bytes_written,
+    })
+
+
+def build(base_dir, scenario, jobs):
+    """
+    Builds the blog in a new process.  Returns the results.
+    """
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+        '--child=%s' % base_dir, '--scenario=%s' % scenario, '--jobs=%d' % jobs])
+
+    return json.loads(output.splitlines()[-1])
+
+
+def append(fname, text):
+
+    with open(fname, 'ab') as f:
+        f.write(text)
+
+
+def edit_template(fname):
+    """
+    Makes a visible change to template fname, so every output using it is
+    rendered and written again: text before its last {% endblock %}
+    (text outside the blocks of a template that extends another is not
+    rendered), or at its end.
+    """
+    with open(fname, 'rb') as f:
+        text = f.read()
+
+    edit = '<p>Edited.</p>\n'
+    i = text.rfind('{% endblock')
+
+    if '{% extends' in text and i != -1:
+        text = text[:i] + edit + text[i:]
+    else:
+        text += '\n' + edit
+
+    with open(fname, 'wb') as f:
+        f.write(text)
+
+
+def bench_size(base_dir, spec, jobs, template):
+    """
+    Generates a blog of spec and runs all scenarios on it.  Returns a dict
+    scenario -> results.
+    """
+    start = time.time()
+    posts = synthetic.generate(base_dir, spec)
+    print "Generated %d posts in %.1fs." % (spec.posts, time.time() - start)
+
+    result = {}
+
+    for scenario in SCENARIOS:
+        if scenario == 'post':
+            append(posts[len(posts) // 2], '\nEdited.\n')
+        elif scenario == 'template':
+            edit_template(os.path.join(base_dir, 'templates', template))
+
+        result[scenario] = build(base_dir, scenario, jobs)
+        report(spec.posts, scenario, result[scenario])
+
+    return result
+
+
+def report(size, scenario, r):
+
+    print "%8d  %-10s %9.2fs %9.1f MB %8d files %9.1f MB written" % (size, scenario,
+        r['wall'], r['peak_rss'] / 1048576.0, r['files'], r['bytes'] / 1048576.0)
+
+
+def main(argv):
+
+    try:
+        opts, args = getopt.getopt(argv, "h", ["help", "sizes=", "jobs=", "template=", "json=",
+            "keep", "child=", "scenario=", "paragraphs=", "code=", "tags=", "tag-pool=",
+            "pages=", "months=", "seed="])
+    except getopt.GetoptError:
+        print __doc__
+        sys.exit(2)
+
+    sizes = [1000, 10000, 50000]
+    jobs = 1
+    template = 'permalink.html'
+    json_file = None
+    keep = False
+    child = None
+    scenario = None
+    spec = synthetic.BlogSpec()
+
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print __doc__
+            sys.exit()
+        elif opt == "--sizes":
+            sizes = [int(s) for s in arg.split(',')]
+        elif opt == "--jobs":
+            jobs = int(arg)
+        elif opt == "--template":
+            template = arg
+        elif opt == "--json":
+            json_file = arg
+        elif opt == "--keep":
+            keep = True
+        elif opt == "--child":
+            child = arg
+        elif opt == "--scenario":
+            scenario = arg
+        elif opt == "--code":
+            spec.code = float(arg)
+        else:
+            setattr(spec, opt[2:].replace('-', '_'), int(arg))
+
+    if child:
+        run_build(child, scenario, jobs)
+        return
+
+    results = {}
+    tmp = tempfile.mkdtemp(prefix='ristretto-bench-')
+
+    try:
+        for size in sizes:
+            spec.posts = size
+            base_dir = os.path.join(tmp, 'blog-%d' % size)
+            results[size] = bench_size(base_dir, spec, jobs, template)
+            if not keep:
+                shutil.rmtree(base_dir)
+    finally:
+        if keep:
+            print "Blogs kept in %s." % tmp
+        else:
+            shutil.rmtree(tmp)
+
+    if json_file:
+        with open(json_file, 'wb') as f:
+            json.dump({'jobs': jobs, 'spec': spec.__dict__, 'results': results}, f,
+                indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,83 @@
+# coding: utf-8
+
+"""
+Microbenchmark for post header parsing.
+
+Compares yaml.load() with the default (pure python) loader, as posts
+headers used to be parsed, yaml with the C safe loader, and
+frontmatter.parse_header().
+
+Usage:
+    python benchmarks/bench_frontmatter.py [number of headers]
+"""
+
+import os
+import sys
+import time
+import datetime
+
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ristretto'))
+
+import frontmatter
+
+
+def make_headers(count):
+    """
+    Returns count headers like the ones written by Post.normalize().
+    """
+    result = []
+    start = datetime.datetime(2010, 1, 1, 10, 0, 0)
+
+    for i in range(count):
+        date = start + datetime.timedelta(hours=13 * i)
+        # non ascii titles are written quoted
+        title = u'Post number %d, with “quotes”' if i % 3 == 0 else u'Post number %d'
+        result.append(u"\n" + yaml.safe_dump({
+            'title': title % i,
+            'slug': 'post-number-%d' % i,
+            'date': date,
+            'status': 'Published',
+            'layout': 'Post',
+            'permalink': 'http://example.com/%s/post-number-%d' % (date.strftime('%Y/%m/%d'), i),
+            'tags': ['tag%d' % (i % 7), 'tag%d' % (i % 11)],
+        }, default_flow_style=False).decode('utf-8'))
+
+    return result
+
+
+def bench(name, parse, headers, baseline=None):
+
+    start = time.time()
+    for header in headers:
+        parse(header)
+    elapsed = time.time() - start
+
+    speedup = " (%.1fx)" % (baseline / elapsed) if baseline else ""
+    print "%-28s %8.3fs %10.1f headers/s%s" % (name, elapsed, len(headers) / elapsed, speedup)
+
+    return elapsed
+
+
+def main(argv):
+
+    count = int(argv[0]) if argv else 2000
+    headers = make_headers(count)
+
+    # parsers must agree before comparing them
+    for header in headers:
+        assert frontmatter.parse_header(header) == yaml.load(header)
+
+    print "%d headers, libyaml %s" % (count, "available" if yaml.__with_libyaml__ else "not available")
+
+    baseline = bench("yaml.load (pure python)", yaml.load, headers)
+
+    if yaml.__with_libyaml__:
+        bench("yaml.load (CSafeLoader)", lambda h: yaml.load(h, Loader=yaml.CSafeLoader), headers, baseline)
+
+    bench("frontmatter.parse_header", frontmatter.parse_header, headers, baseline)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
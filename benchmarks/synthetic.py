@@ -0,0 +1,202 @@
+# coding: utf-8
+
+"""
+Generates a synthetic blog for benchmarks: posts, pages, templates (from
+example.com/templates) and a settings module.
+
+Usage:
+    python benchmarks/synthetic.py [options] base_dir
+
+    --posts=N           number of posts (default 1000)
+    --paragraphs=N      paragraphs per post (default 6)
+    --code=F            chance of a code block after each paragraph (default 0.2)
+    --tags=N            tags per post (default 3)
+    --tag-pool=N        number of distinct tags (default 50)
+    --pages=N           number of pages (default 5)
+    --months=N          months the posts are spread over (default 60)
+    --seed=N            random seed (default 1)
+"""
+
+import os
+import sys
+import random
+import shutil
+import getopt
+import datetime
+
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+TEMPLATES_DIR = os.path.join(REPO_DIR, 'example.com', 'templates')
+SAMPLE_SETTINGS = os.path.join(REPO_DIR, 'ristretto', 'sample_settings.py')
+
+# Name of the generated settings module
+SETTINGS_MODULE = 'bench_settings'
+
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod "
+    "tempor incididunt ut labore et dolore magna aliqua enim ad minim veniam quis "
+    "nostrud exercitation ullamco laboris nisi aliquip ex ea commodo consequat").split()
+
+CODE = """    :::python
+    def fib(n):
+        a, b = 0, 1
+        for i in range(n):
+            a, b = b, a + b
+        return a
+"""
+
+
+class BlogSpec(object):
+    """
+    Size and shape of a synthetic blog.
+    """
+
+    def __init__(self, posts=1000, paragraphs=6, code=0.2, tags=3, tag_pool=50,
+                 pages=5, months=60, seed=1, *args, **kwargs):
+
+        self.posts = posts
+        self.paragraphs = paragraphs
+        self.code = code
+        self.tags = tags
+        self.tag_pool = tag_pool
+        self.pages = pages
+        self.months = months
+        self.seed = seed
+
+
+
+def sentence(rnd, words):
+
+    return ' '.join(rnd.choice(WORDS) for i in range(words)).capitalize() + '.'
+
+
+def paragraph(rnd):
+
+    result = ' '.join(sentence(rnd, rnd.randint(6, 18)) for i in range(rnd.randint(2, 6)))
+
+    # some inline markup
+    words = result.split(' ')
+    i = rnd.randrange(len(words))
+    words[i] = '*%s*' % words[i]
+    i = rnd.randrange(len(words))
+    words[i] = '[%s](http://example.org/%d)' % (words[i], i)
+
+    return ' '.join(words)
+
+
+def body(rnd, spec):
+
+    result = []
+
+    for i in range(spec.paragraphs):
+        result.append(paragraph(rnd))
+        if rnd.random() < spec.code:
+            result.append(CODE)
+
+    return '\n\n'.join(result)
+
+
+def header(title, slug, date, layout, tags):
+    """
+    Returns a post header as Post.normalize() writes them.
+    """
+    lines = [
+        '---',
+        'date: %s' % date.strftime('%Y-%m-%d %H:%M:%S'),
+        'layout: %s' % layout,
+        'slug: %s' % slug,
+        'status: Published',
+    ]
+    if tags:
+        lines.append('tags:')
+        lines.extend('- %s' % t for t in tags)
+    lines.append('title: %s' % title)
+    lines.append('---')
+
+    return '\n'.join(lines) + '\n'
+
+
+def generate(base_dir, spec):
+    """
+    Creates a blog in base_dir (deleting what was there).  Returns the
+    list of post file names, oldest first.
+    """
+    rnd = random.Random(spec.seed)
+
+    if os.path.exists(base_dir):
+        shutil.rmtree(base_dir)
+
+    for d in ('drafts/_preview', 'drafts/_publishnow', 'posts', 'pages', 'media', 'www/static'):
+        os.makedirs(os.path.join(base_dir, d))
+
+    shutil.copytree(TEMPLATES_DIR, os.path.join(base_dir, 'templates'))
+
+    with open(SAMPLE_SETTINGS, 'rb') as f:
+        settings = f.read()
+    with open(os.path.join(base_dir, SETTINGS_MODULE + '.py'), 'wb') as f:
+        f.write(settings)
+        f.write('\n# benchmark blog\nBASE_DIR = %r\n' % base_dir)
+
+    for i in range(spec.pages):
+        with open(os.path.join(base_dir, 'pages', 'page-%d.md' % i), 'wb') as f:
+            f.write(header('Page %d' % i, 'page-%d' % i, datetime.datetime(2010, 1, 1), 'Page', []))
+            f.write(body(rnd, spec))
+
+    # spread posts evenly over the months
+    start = datetime.datetime(2000, 1, 1)
+    span = (datetime.datetime(2000 + spec.months // 12, 1 + spec.months % 12, 1) - start).total_seconds()
+    tags = ['tag-%d' % i for i in range(spec.tag_pool)]
+    sequences = {}
+    result = []
+
+    for i in range(spec.posts):
+        date = start + datetime.timedelta(seconds=int(span * i / spec.posts))
+        slug = 'post-%d' % i
+
+        day = date.strftime('%Y%m%d')
+        sequences[day] = sequences.get(day, 0) + 1
+
+        dname = os.path.join(base_dir, 'posts', date.strftime('%Y'), date.strftime('%m'))
+        if not os.path.isdir(dname):
+            os.makedirs(dname)
+
+        fname = os.path.join(dname, '%s-p%02d-%s.md' % (day, sequences[day], slug))
+        with open(fname, 'wb') as f:
+            f.write(header('Post number %d' % i, slug, date, 'Post',
+                rnd.sample(tags, min(spec.tags, len(tags)))))
+            f.write(body(rnd, spec))
+            f.write('\n')
+
+        result.append(fname)
+
+    return result
+
+
+def main(argv):
+
+    try:
+        opts, args = getopt.getopt(argv, "h", ["help", "posts=", "paragraphs=", "code=",
+            "tags=", "tag-pool=", "pages=", "months=", "seed="])
+    except getopt.GetoptError:
+        print __doc__
+        sys.exit(2)
+
+    if len(args) != 1:
+        print __doc__
+        sys.exit(2)
+
+    spec = BlogSpec()
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print __doc__
+            sys.exit()
+        elif opt == "--code":
+            spec.code = float(arg)
+        else:
+            setattr(spec, opt[2:].replace('-', '_'), int(arg))
+
+    posts = generate(os.path.abspath(args[0]), spec)
+    print "Generated %d posts in %s." % (len(posts), args[0])
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,204 @@
+# coding: utf-8
+
+
+import os
+import re
+import json
+import logging
+import tempfile
+
+import tools
+import compress
+
+
+# Hex digits of the content hash in asset file names
+HASH_LENGTH = 12
+
+# Content-hashed copies (style.3f2a9c1b07d4.css, or pruned stylesheets
+# style.pruned.3f2a9c1b07d4.css)
+_hashed = re.compile(r'\.[0-9a-f]{%d}\.[^./]+$' % HASH_LENGTH)
+
+
+class AssetManifest(object):
+    """
+    Static and media files published under content-hashed names (i.e.,
+    static/css/style.3f2a9c1b07d4.css), so they can be served with
+    far-future cache headers: a changed file gets a new url.
+
+    Assets are named by the url path of their directory and their path in
+    it (i.e., 'static/css/style.css', 'media/photo.jpg'), so files in
+    different directories never hide each other.  Names without the path
+    of a directory (i.e., 'css/style.css', as templates use them) are
+    looked up in the first one.  Digests are kept with the stat data of
+    each file, so only files that changed since the previous build are
+    hashed again.
+
+    When the copies are written to the directories scanned for assets,
+    files named as generated (hashed copies, .gz copies) are not assets,
+    even if the build manifest that recorded them is lost.
+
+    The manifest, saved to fname, maps each asset name to its source
+    file, digest and url.
+
+    Args:
+        dirs
+            list of (source directory, url of the directory), i.e.
+            ('/blog/static', '/static').
+    """
+
+    def __init__(self, fname, dirs, *args, **kwargs):
+
+        self.fname = fname
+        self.dirs = dirs
+
+        self.assets = {}        # name -> {'source', 'stat', 'digest', 'url'}
+
+        # name -> url of a file published instead of the asset (i.e., a 
+        # pruned stylesheet)
+        self.overrides = {}
+
+        self.load()
+
+
+    def load(self):
+
+        self.assets = {}
+
+        if os.path.exists(self.fname):
+            try:
+                with open(self.fname, 'rb') as f:
+                    self.assets = json.load(f)['assets']
+            except (ValueError, KeyError) as e:
+                logging.error("Ignoring unreadable asset manifest %s. Error: %s." % (self.fname, e))
+
+
+    def save(self):
+
+        tools.mkdirp(os.path.dirname(self.fname))
+
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.fname), prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            json.dump({'assets': self.assets}, f, indent=1, sort_keys=True)
+        os.rename(tmp, self.fname)
+
+
+    def refresh(self, ignore=(), skip=None):
+        """
+        Scans the asset directories, hashing new and changed files, and saves
+        the manifest if assets changed.  Returns the number of files hashed.
+
+        Args:
+            ignore
+                set of file names to skip (i.e., outputs recorded by the
+                build manifest).
+            skip
+                if given, called with each file name; files for which it
+                returns True are skipped too (i.e., image variants).
+        """
+        previous = self.assets
+        self.assets = {}
+        hashed = 0
+
+        for dname, url in self.dirs:
+            for root, dirs, files in os.walk(dname):
+                dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+
+                for f in sorted(files):
+                    fname = os.path.join(root, f)
+                    if f.startswith('.') or fname in ignore or generated(fname):
+                        continue
+                    if skip is not None and skip(fname):
+                        continue
+
+                    # unicode, as names and urls loaded from the manifest
+                    source = fname.decode('utf-8')
+                    name = '%s/%s' % (url.strip('/'), 
+                        os.path.relpath(fname, dname).decode('utf-8').replace(os.sep, '/'))
+
+                    stat = tools.file_fingerprint(fname)
+                    asset = previous.get(name)
+
+                    if asset is None or asset['source'] != source or asset['stat'] != stat:
+                        digest = tools.file_hash(fname)
+                        asset = {
+                            'source': source,
+                            'stat': stat,
+                            'digest': digest,
+                            'url': '/%s' % hashed_name(name, digest),
+                        }
+                        hashed += 1
+
+                    self.assets[name] = asset
+
+        if hashed or set(previous) != set(self.assets):
+            self.save()
+
+        return hashed
+
+
+    def key(self, name):
+        """
+        Returns the full name of asset name, with the url path of its
+        directory (see AssetManifest).
+        """
+        name = name.lstrip('/')
+        if name in self.assets:
+            return name
+
+        return u'%s/%s' % (self.dirs[0][1].strip('/'), name)
+
+
+    def get(self, name):
+        """
+        Returns the asset name (a dict with its source, digest and url), or
+        None if there is no such asset.
+        """
+        return self.assets.get(self.key(name))
+
+
+    def url(self, name):
+        """
+        Returns the url of asset name, or None if there is no such asset.
+        """
+        key = self.key(name)
+        if key in self.overrides:
+            return self.overrides[key]
+
+        asset = self.assets.get(key)
+
+        return asset['url'] if asset else None
+
+
+    def fingerprint(self, names=None):
+        """
+        Returns a fingerprint of the urls of assets names (all assets if
+        None).
+        """
+        if names is None:
+            names = self.assets.keys()
+
+        return tools.fingerprint(sorted((unicode(n), self.url(n)) for n in names))
+
+
+
+def generated(fname):
+    """
+    Returns True if fname is named as a file written by builds: a 
+    content-hashed copy, or the compressed copy of a file next to it.
+    """
+    if _hashed.search(os.path.basename(fname)):
+        return True
+
+    ext = compress.SIDECAR_EXT
+
+    return fname.endswith(ext) and os.path.exists(fname[:-len(ext)])
+
+
+def hashed_name(name, digest):
+    """
+    Returns name with digest before its extension: css/style.css ->
+    css/style.<digest>.css
+    """
+    base, ext = os.path.splitext(name)
+
+    return '%s.%s%s' % (base, digest[:HASH_LENGTH], ext)
@@ -43,6 +43,24 @@ setting_vars = [
     'ERR_500_PAGE',
 ]
 
+# Variables that blog-specific settings module may override; defaults are
+# defined below
+optional_setting_vars = [
+    'RENDER_CACHE_MAX_SIZE',
+    'BLOG_AUTHOR',
+    'FEED_ITEMS',
+    'TAG_FEEDS',
+    'PAGINATION_STABLE',
+    'GZIP_OUTPUTS',
+    'MINIFY_HTML',
+    'PRUNE_CSS',
+    'PRUNE_CSS_KEEP',
+    'INLINE_CRITICAL_CSS',
+    'RESPONSIVE_IMAGES',
+    'IMAGE_WIDTHS',
+    'IMAGE_WEBP',
+]
+
 s = importlib.import_module(shared.blog_settings)
 
 # import blog_settings variables into module namespace
@@ -53,8 +71,26 @@ for key in setting_vars:
 # Logging
 LOG_FILE = "ristretto.log"
 
-# RSS feed file
+# Feed files (also used for tag feeds, in each tag directory)
 RSS_FILE = 'rss.xml'
+ATOM_FILE = 'atom.xml'
+JSON_FEED_FILE = 'feed.json'
+
+# Number of posts in feeds
+FEED_ITEMS = 20
+
+# Author of the blog's posts, named in Atom feeds (BLOG_TITLE if None)
+BLOG_AUTHOR = None
+
+# Publish feeds for each tag
+TAG_FEEDS = True
+
+# Number listing pages (index-N.html) from the oldest post instead of the
+# newest, so publishing a post leaves older pages untouched
+PAGINATION_STABLE = False
+
+# Write a gzip compressed copy of html, xml and json outputs and static files
+GZIP_OUTPUTS = False
 
 #
 # Directories
@@ -89,6 +125,18 @@ TAGGED_DIR = os.path.join(WWW_DIR, WWW_TAGGED_URL)
 # Templates
 TEMPLATES_DIR = os.path.join(BASE_DIR, WWW_TEMPLATES_URL)
 
+# Data kept between builds (render cache, etc.)
+CACHE_DIR = os.path.join(BASE_DIR, 'cache')
+RENDER_CACHE_DIR = os.path.join(CACHE_DIR, 'render')
+MANIFEST_FILE = os.path.join(CACHE_DIR, 'manifest.json')
+INDEX_FILE = os.path.join(CACHE_DIR, 'index.sqlite')
+TEMPLATES_CACHE_DIR = os.path.join(CACHE_DIR, 'templates')
+MINIFY_CACHE_DIR = os.path.join(CACHE_DIR, 'minified')
+CSS_USAGE_FILE = os.path.join(CACHE_DIR, 'css.json')
+IMAGES_INDEX_FILE = os.path.join(CACHE_DIR, 'images.json')
+IMAGES_CACHE_DIR = os.path.join(CACHE_DIR, 'images')
+ASSETS_MANIFEST_FILE = os.path.join(CACHE_DIR, 'assets.json')
+
 
 
 
@@ -111,6 +159,36 @@ MD_EXTENSION_CONFIGS = {
 }
 MD_OUTPUT_FORMAT = 'html5'
 
+# Minify rendered html (whitespace and comments; pre, script, style and
+# textarea elements are left as is)
+MINIFY_HTML = False
+
+# Stylesheet assets (i.e., 'css/bootstrap.min.css') published with only the
+# rules used by pages; asset_url() returns the pruned stylesheet.  Its url
+# only changes with the stylesheet, not with the rules pages use, so pages
+# are not written again when those change: do not serve pruned stylesheets
+# with far-future cache headers.
+PRUNE_CSS = []
+
+# Classes, ids and tags to keep in pruned stylesheets, for those only added
+# by scripts (i.e., '.open', '.in')
+PRUNE_CSS_KEEP = []
+
+# Inline in each page the rules of PRUNE_CSS stylesheets used above the fold
+# (up to css.CRITICAL_CSS_MAX bytes) and load those stylesheets without
+# blocking rendering
+INLINE_CRITICAL_CSS = False
+
+# Publish resized variants of the images in the media dir used by posts and
+# give their <img> tags a srcset, their size and lazy loading.  Requires
+# Pillow (optional, see pip_requirements.txt).
+RESPONSIVE_IMAGES = False
+IMAGE_WIDTHS = [480, 960, 1440]
+IMAGE_WEBP = False
+
+# Max size in bytes of the rendered markdown cache
+RENDER_CACHE_MAX_SIZE = 64 * 1024 * 1024
+
 #
 # Post header variables
 #
@@ -138,3 +216,9 @@ POST_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'   # 2012-12-19 20:10:12
 
 MAX_POSTS_PER_DAY = 99
 
+
+
+# Override defaults with values from blog_settings, if present
+for key in optional_setting_vars:
+    if key in s.__dict__:
+        globals()[key] = s.__dict__[key]
@@ -0,0 +1,83 @@
+# coding: utf-8
+
+
+import os
+import gzip
+import shutil
+import tempfile
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+from writer import FILE_MODE
+
+
+# Outputs compressed, by extension.  Files in the static dir are all
+# compressed, except those in already compressed formats.
+GZIP_EXTENSIONS = ('.html', '.xml', '.json')
+COMPRESSED_EXTENSIONS = ('.gz', '.zip', '.png', '.jpg', '.jpeg', '.gif', '.webp',
+    '.ico', '.woff', '.woff2', '.mp3', '.mp4', '.pdf')
+
+SIDECAR_EXT = '.gz'
+
+
+def sidecar(fname):
+    """
+    Returns the file name of the compressed copy of fname.
+    """
+    return fname + SIDECAR_EXT
+
+
+def gzip_file(fname):
+    """
+    Writes a compressed copy of fname, at max. compression, replacing the
+    previous one atomically.  The copy gets the mtime of fname.  Returns
+    the size of the copy.
+    """
+    st = os.stat(fname)
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(fname), prefix='.tmp-')
+    with os.fdopen(fd, 'wb') as out:
+        with open(fname, 'rb') as f:
+            gz = gzip.GzipFile(os.path.basename(fname), 'wb', 9, out, mtime=st.st_mtime)
+            shutil.copyfileobj(f, gz, 65536)
+            gz.close()
+        size = out.tell()
+
+    os.chmod(tmp, FILE_MODE)
+    os.utime(tmp, (st.st_atime, st.st_mtime))
+    os.rename(tmp, sidecar(fname))
+
+    return size
+
+
+def gzip_files(fnames):
+    """
+    Compresses fnames using a thread per cpu (zlib releases the GIL while
+    compressing).  Returns a list of (file name, compressed size).
+    """
+    if len(fnames) < 2:
+        return [(f, gzip_file(f)) for f in fnames]
+
+    pool = ThreadPool(min(len(fnames), multiprocessing.cpu_count()))
+    try:
+        return zip(fnames, pool.map(gzip_file, fnames))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def static_files(dname):
+    """
+    Returns the files in dname (recursively) that should be compressed.
+    """
+    result = []
+
+    for root, dirs, files in os.walk(dname):
+        for f in files:
+            if f.startswith('.'):
+                continue
+
+            if os.path.splitext(f)[1].lower() not in COMPRESSED_EXTENSIONS:
+                result.append(os.path.join(root, f))
+
+    return sorted(result)
@@ -0,0 +1,154 @@
+# coding: utf-8
+
+
+import os
+import logging
+
+from post import Post
+from source_index import SourceIndex, load_post, file_sequence
+import tools
+
+
+class Corpus(object):
+    """
+    Build-scoped collection of parsed posts and pages.
+
+    Posts are read from POSTS_DIR in a single directory pass and parsed
+    once; every publisher shares the same Post instances instead of
+    re-reading the .md files.  Publishers must not modify these instances
+    in place (see Updater.prepared()).
+
+    Parsed posts are kept in a SourceIndex between builds, so only files
+    that changed since the previous build are parsed.  Calling load() 
+    again refreshes the corpus.
+    """
+
+    def __init__(self, settings, *args, **kwargs):
+
+        self.s = settings
+
+        self.posts = []     # posts, newest first
+        self.pages = []     # pages, in PAGES_DIR listing order
+        self.by_fname = {}  # source file name -> post or page
+        self.fingerprints = {}  # source file name -> file fingerprint
+        self.parsed = 0     # files parsed by last load()
+
+        settings_fingerprint = [(k, getattr(self.s, k)) for k in sorted(dir(self.s)) if k.isupper()]
+        self.index = SourceIndex(self.s.INDEX_FILE, self.s.BASE_DIR, salt=settings_fingerprint)
+
+        self.load()
+
+
+    def load(self):
+
+        old_posts = self.by_fname
+        old_fingerprints = self.fingerprints
+
+        self.fingerprints = {}
+
+        page_files = self.refresh_index()
+
+        posts = [self.load_post(row, old_posts, old_fingerprints) for row in self.index.posts('post')]
+
+        pages = dict((row[0], self.load_post(row, old_posts, old_fingerprints)) 
+            for row in self.index.posts('page'))
+        pages = [pages[f] for f in page_files]
+
+        self.posts = posts
+        self.pages = pages
+        self.by_fname = dict((p.fname, p) for p in self.posts + self.pages)
+
+        logging.info("Loaded %d posts and %d pages (%d parsed)." % (len(self.posts), len(self.pages), self.parsed))
+
+
+    def refresh_index(self):
+        """
+        Updates the index with changes to posts and pages since the last
+        refresh.  Returns the pages file names, in PAGES_DIR listing order.
+        """
+        page_files = []
+        if os.path.isdir(self.s.PAGES_DIR):
+            page_files = [os.path.join(self.s.PAGES_DIR, f) 
+                for f in os.listdir(self.s.PAGES_DIR) if f.endswith(self.s.MD_EXT)]
+
+        sources = ([(f, 'post') for f in self.find_sources(self.s.POSTS_DIR)] + 
+            [(f, 'page') for f in page_files])
+
+        self.parsed = self.index.refresh(sources, lambda fname: Post(fname, self.s))
+
+        return page_files
+
+
+    def load_post(self, row, old_posts, old_fingerprints):
+        """
+        Returns the post in an index row, reusing the one from the previous
+        load if the file did not change.
+        """
+        fname, fingerprint, state = row
+        self.fingerprints[fname] = fingerprint
+
+        if old_fingerprints.get(fname) == fingerprint:
+            return old_posts[fname]
+
+        return load_post(state, fname, fingerprint, self.s)
+
+
+    def find_sources(self, d):
+        """
+        Returns the paths of all .md files under d.
+        """
+        result = []
+
+        for root, dirs, files in os.walk(d):
+            for f in files:
+                if os.path.splitext(f)[1] == self.s.MD_EXT:
+                    result.append(os.path.join(root, f))
+
+        return result
+
+
+    def get(self, fname):
+        return self.by_fname[fname]
+
+
+    def fingerprint(self, fname):
+        """
+        Returns the fingerprint of source file fname, as of corpus loading.
+        """
+        if fname not in self.fingerprints:
+            self.fingerprints[fname] = tools.file_fingerprint(fname)
+
+        return self.fingerprints[fname]
+
+
+    def months(self):
+        """
+        Returns a sorted list of (year, month) with posts.
+        """
+        return self.index.months()
+
+
+    def tagged(self):
+        """
+        Returns a list of (tag, posts with tag, newest first), sorted by 
+        tag.
+        """
+        return [(tag, [self.by_fname[f] for f in fnames]) for tag, fnames in self.index.tagged()]
+
+
+    def next_sequence(self, dname, day):
+        """
+        Returns the sequence number for a new post of day (YYYYMMDD) in
+        directory dname: one more than the highest sequence number of the
+        day's posts.  Only dname is listed: posts published since the corpus
+        was loaded are not in the index yet.
+        """
+        seq = []
+        if os.path.isdir(dname):
+            for f in os.listdir(dname):
+                if f.endswith(self.s.MD_EXT):
+                    file_day, sequence = file_sequence(f)
+                    if file_day == day:
+                        seq.append(sequence)
+
+        return max(seq) + 1 if seq else 1
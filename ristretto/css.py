@@ -0,0 +1,309 @@
+# coding: utf-8
+
+
+import os
+import re
+import json
+import logging
+import tempfile
+
+import tools
+
+
+# Bytes of a page, from <body>, whose elements are considered above the
+# fold for critical css
+CRITICAL_BYTES = 14 * 1024
+
+# Max. bytes of css inlined in a page: pages with more critical css keep
+# their stylesheets render-blocking instead
+CRITICAL_CSS_MAX = 8 * 1024
+
+_comment = re.compile(r'/\*.*?\*/', re.S)
+
+# Parts of selectors that do not affect which elements are used: pseudo
+# classes and elements (with their arguments), attribute selectors
+_ignored = re.compile(r'::?[\w-]+(\([^)]*\))?|\[[^\]]*\]')
+
+# Type, class and id selectors
+_simple = re.compile(r'([.#]?)(-?[_a-zA-Z][\w-]*)')
+
+# At-rules whose rules are pruned like top-level rules
+_nested = ('@media', '@supports', '@document')
+
+# At-rule name, also when followed by no space (@media(max-width:767px))
+_at_rule = re.compile(r'@[\w-]*')
+
+# Tags, classes and ids used in html
+_tag = re.compile(r'<([a-zA-Z][a-zA-Z0-9]*)')
+_class = re.compile(r'''\sclass\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))''', re.I)
+_id = re.compile(r'''\sid\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))''', re.I)
+
+# Stylesheet links
+_link = re.compile(r'<link\b[^>]*>', re.I)
+_href = re.compile(r'''\shref\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))''', re.I)
+_rel_stylesheet = re.compile(r'''\srel\s*=\s*(["']?)stylesheet\1''', re.I)
+
+
+class Stylesheet(object):
+    """
+    A parsed stylesheet, for writing the rules that apply to the tags,
+    classes and ids used by pages.
+
+    Rules are kept if any of their selectors only uses types, classes and
+    ids in use (pseudo classes and attribute selectors are ignored).
+    At-rules are kept as they are, except @media (and @supports) blocks,
+    whose rules are pruned, also in minified css:
+
+    >>> Stylesheet('@media(max-width:767px){.unused{color:red}} .used{x:y}').write({'.used'})
+    '.used{x:y}'
+    """
+
+    def __init__(self, text, *args, **kwargs):
+
+        self.items = parse(_comment.sub('', text))
+
+
+    def write(self, used):
+        """
+        Returns the rules that apply to used (a set of tokens, see
+        tokens()).
+        """
+        return write(self.items, used)
+
+
+
+class CssUsage(object):
+    """
+    Persisted record of the tags, classes and ids used by each page, so
+    only pages written by a build are scanned again.
+
+    Paths are stored relative to base_dir.
+    """
+
+    def __init__(self, fname, base_dir, *args, **kwargs):
+
+        self.fname = fname
+        self.base_dir = base_dir
+
+        self.pages = {}     # page path -> tokens used
+        self.used = []      # tokens used by all pages
+
+        self.load()
+
+
+    def load(self):
+
+        if os.path.exists(self.fname):
+            try:
+                with open(self.fname, 'rb') as f:
+                    data = json.load(f)
+                self.pages = data['pages']
+                self.used = data['used']
+            except (ValueError, KeyError) as e:
+                logging.error("Ignoring unreadable css usage %s. Error: %s." % (self.fname, e))
+
+
+    def save(self):
+
+        tools.mkdirp(os.path.dirname(self.fname))
+
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.fname), prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            json.dump({'pages': self.pages, 'used': self.used}, f)
+        os.rename(tmp, self.fname)
+
+
+    def update(self, pages, written):
+        """
+        Scans pages that were written, or not scanned before, and forgets
+        pages that no longer exist.  Returns the set of tokens used by all
+        pages.
+
+        Args:
+            pages
+                file names of all pages.
+            written
+                set of file names written by this build.
+        """
+        current = {}
+        changed = False
+
+        for fname in pages:
+            path = os.path.relpath(fname, self.base_dir)
+
+            if fname in written or path not in self.pages:
+                with open(fname, 'rb') as f:
+                    current[path] = sorted(tokens(f.read()))
+                changed = True
+            else:
+                current[path] = self.pages[path]
+
+        if changed or set(current) != set(self.pages):
+            used = set()
+            for t in current.itervalues():
+                used.update(t)
+            self.used = sorted(used)
+
+        self.pages = current
+
+        return set(self.used)
+
+
+
+def parse(text):
+    """
+    Returns the items in css text: ('rule', [(selector, tokens)], body),
+    ('block', prelude, items) for @media blocks and ('raw', text) for other
+    at-rules.
+    """
+    items = []
+    pos = 0
+
+    while True:
+        start = _skip_space(text, pos)
+        if start >= len(text) or text[start] == '}':
+            break
+
+        if text[start] == '@':
+            brace = text.find('{', start)
+            semicolon = text.find(';', start)
+
+            if semicolon != -1 and (brace == -1 or semicolon < brace):
+                # @import, @charset...
+                items.append(('raw', text[start:semicolon + 1]))
+                pos = semicolon + 1
+                continue
+
+            if brace == -1:
+                break
+
+            prelude = text[start:brace].strip()
+
+            if _at_rule.match(prelude).group(0).lower() in _nested:
+                end = _block_end(text, brace)
+                items.append(('block', prelude, parse(text[brace + 1:end])))
+            else:
+                end = _block_end(text, brace)
+                items.append(('raw', text[start:end + 1]))
+
+            pos = end + 1
+            continue
+
+        brace = text.find('{', start)
+        if brace == -1:
+            break
+
+        end = text.find('}', brace)
+        if end == -1:
+            end = len(text)
+
+        selectors = [s.strip() for s in text[start:brace].split(',') if s.strip()]
+        items.append(('rule', [(s, selector_tokens(s)) for s in selectors],
+            text[brace + 1:end].strip()))
+
+        pos = end + 1
+
+    return items
+
+
+def write(items, used):
+
+    result = []
+
+    for item in items:
+        if item[0] == 'raw':
+            result.append(item[1])
+
+        elif item[0] == 'block':
+            inner = write(item[2], used)
+            if inner:
+                result.append('%s{\n%s\n}' % (item[1], inner))
+
+        else:
+            selectors = [s for s, tokens in item[1] if tokens <= used]
+            if selectors:
+                result.append('%s{%s}' % (','.join(selectors), item[2]))
+
+    return '\n'.join(result)
+
+
+def selector_tokens(selector):
+    """
+    Returns the set of types ('a'), classes ('.btn') and ids ('#main') an
+    element must use for selector to apply.
+    """
+    return frozenset(prefix + name.lower() if not prefix else prefix + name
+        for prefix, name in _simple.findall(_ignored.sub('', selector)))
+
+
+def tokens(html):
+    """
+    Returns the set of tags, classes and ids used in html, as selector
+    tokens.
+    """
+    result = set(t.lower() for t in _tag.findall(html))
+
+    for m in _class.finditer(html):
+        result.update('.' + c for c in (m.group(1) or m.group(2) or m.group(3) or '').split())
+
+    for m in _id.finditer(html):
+        result.add('#' + (m.group(1) or m.group(2) or m.group(3) or '').strip())
+
+    return result
+
+
+def above_the_fold(html):
+    """
+    Returns the start of html, up to CRITICAL_BYTES past <body>.
+    """
+    body = html.find('<body')
+
+    return html[:max(body, 0) + CRITICAL_BYTES]
+
+
+def defer_stylesheets(html, urls):
+    """
+    Returns html with its stylesheet links to urls loaded without blocking
+    rendering: preloaded and applied once loaded, or linked as before in a
+    <noscript> for browsers without javascript.
+    """
+    def defer(m):
+        tag = m.group(0)
+
+        href = _href.search(tag)
+        if href is None or not _rel_stylesheet.search(tag):
+            return tag
+        if (href.group(1) or href.group(2) or href.group(3)) not in urls:
+            return tag
+
+        preload = _rel_stylesheet.sub(
+            ''' rel="preload" as="style" onload="this.onload=null;this.rel='stylesheet'"''', tag, 1)
+
+        return '%s<noscript>%s</noscript>' % (preload, tag)
+
+    return _link.sub(defer, html)
+
+
+def _skip_space(text, pos):
+
+    while pos < len(text) and text[pos].isspace():
+        pos += 1
+
+    return pos
+
+
+def _block_end(text, brace):
+    """
+    Returns the position of the } closing the block opened at brace.
+    """
+    depth = 0
+
+    for i in xrange(brace, len(text)):
+        if text[i] == '{':
+            depth += 1
+        elif text[i] == '}':
+            depth -= 1
+            if depth == 0:
+                return i
+
+    return len(text)
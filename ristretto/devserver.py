@@ -0,0 +1,189 @@
+# coding: utf-8
+
+
+import os
+import time
+import urllib
+import logging
+import threading
+
+from post import NotAPostException, PostIsDraftException, Post
+from preview import PreviewRequestHandler, PreviewServer
+import tools
+
+
+class OnDemandRenderer(object):
+    """
+    Renders single pages of the blog when they are requested, instead of
+    building the whole site.
+
+    Request paths are mapped to the outputs planned by the updater (the
+    same ones a build would write), plus DRAFTS_URL for drafts previews.
+    Rendered pages are kept until their dependencies change.  Content-hashed
+    copies of static and media files are written to WWW_DIR, as in a build.
+    """
+
+    # URL for drafts previews, i.e. /drafts/_preview/my-draft.html
+    DRAFTS_URL = '/drafts/_preview/'
+
+    # Min seconds between checks of the sources for changes
+    REFRESH_INTERVAL = 1.0
+
+    def __init__(self, updater, *args, **kwargs):
+
+        self.updater = updater
+        self.s = updater.s
+
+        self.outputs = {}   # url -> output
+        self.rendered = {}  # url -> (dependencies, content, time rendered)
+        self.last_refresh = 0
+
+        # updater is not thread safe
+        self.lock = threading.Lock()
+
+
+    def url_for(self, fname):
+
+        return '/' + os.path.relpath(fname, self.s.WWW_DIR).replace(os.sep, '/')
+
+
+    def refresh(self):
+        """
+        Reloads changed sources and maps urls to outputs.
+        """
+        if time.time() - self.last_refresh < self.REFRESH_INTERVAL:
+            return
+
+        self.updater.load_corpus()
+
+        # save the copies' records, as a build does, so the next build does
+        # not take them for new assets
+        if self.updater.publish_assets():
+            self.updater.manifest.save()
+        self.outputs = dict((self.url_for(o.fname), o) for o in self.updater.plan_all())
+
+        self.last_refresh = time.time()
+
+
+    def has(self, url):
+
+        with self.lock:
+            self.refresh()
+            return self.normalize(url) in self.outputs
+
+
+    def normalize(self, url):
+
+        if url.endswith('/'):
+            url = url + 'index.html'
+
+        return url
+
+
+    def render(self, url):
+        """
+        Returns (content, version, mtime) for the page at url, or None if
+        the build has no page for url.  version changes every time content
+        changes.
+        """
+        url = self.normalize(url)
+
+        with self.lock:
+            self.refresh()
+
+            if url.startswith(self.DRAFTS_URL):
+                return self.render_draft(url)
+
+            output = self.outputs.get(url)
+            if output is None:
+                return None
+
+            deps = self.updater.output_deps(output)
+
+            return self.get_rendered(url, deps, lambda: self.updater.render_output(output))
+
+
+    def render_draft(self, url):
+
+        name = os.path.splitext(url[len(self.DRAFTS_URL):])[0]
+        fname = os.path.join(self.s.DRAFTS_DIR, "%s%s" % (name, self.s.MD_EXT))
+
+        if '/' in name or not os.path.exists(fname):
+            return None
+
+        deps = dict(self.updater.get_fingerprints())
+        deps['templates'] = self.updater.templates.fingerprint(self.s.PERMALINK_TEMPLATE)
+        deps['source'] = tools.file_fingerprint(fname)
+
+        def render():
+            html = self.updater.render_draft_preview(Post(fname, self.s))
+            return html.encode(self.s.OUTPUT_ENCODING)
+
+        try:
+            return self.get_rendered(url, deps, render)
+        except (NotAPostException, PostIsDraftException):
+            return None
+
+
+    def get_rendered(self, url, deps, render):
+
+        cached = self.rendered.get(url)
+
+        if cached is None or cached[0] != deps:
+            start = time.time()
+            cached = (deps, render(), int(time.time()))
+            self.rendered[url] = cached
+            logging.info("Rendered %s in %.3fs." % (url, time.time() - start))
+
+        deps, content, mtime = cached
+
+        return content, tools.fingerprint(sorted(deps.items())), mtime
+
+
+
+class DevRequestHandler(PreviewRequestHandler):
+    """
+    Serves pages rendered on demand, and other files (static, media) from
+    WWW_DIR.
+    """
+
+    def send_file(self, head_only):
+
+        renderer = self.server.renderer
+        url = urllib.unquote(self.path.split('?', 1)[0].split('#', 1)[0])
+
+        try:
+            result = renderer.render(url)
+
+            if result is None and not url.endswith('/') and renderer.has(url + '/'):
+                self.send_response(301)
+                self.send_header('Location', url + '/')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+        except Exception as e:
+            logging.exception("Could not render %s." % url)
+            self.send_error(500, "Could not render %s: %s" % (url, e))
+            return
+
+        if result is None:
+            return PreviewRequestHandler.send_file(self, head_only)
+
+        content, version, mtime = result
+        self.send_content(content, self.guess_type(renderer.normalize(url)), version, mtime, head_only)
+
+
+
+class DevServer(PreviewServer):
+    """
+    Preview server that renders pages from the .md sources on request.
+    """
+
+    handler_class = DevRequestHandler
+
+    def __init__(self, address, updater):
+
+        PreviewServer.__init__(self, address, updater.s.WWW_DIR)
+
+        self.renderer = OnDemandRenderer(updater)
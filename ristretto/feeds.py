@@ -0,0 +1,164 @@
+# coding: utf-8
+
+
+import json
+import calendar
+from email.utils import formatdate
+from xml.sax.saxutils import escape, quoteattr
+
+
+# Feed formats
+RSS = 'rss'
+ATOM = 'atom'
+JSON = 'json'
+
+
+class Feed(object):
+    """
+    Data shared by all formats of a feed.
+
+    Args:
+        items
+            list of FeedItem, newest first.
+        author
+            name of the author of the feed's items.
+    """
+
+    def __init__(self, title, link, description, feed_url, items, author=None):
+
+        self.title = title
+        self.link = link
+        self.description = description
+        self.feed_url = feed_url
+        self.items = items
+        self.author = author
+
+    def updated(self):
+        """
+        Returns the date of the newest item, or None if there are no items.
+        Used instead of current time so the feed only changes when its
+        items change.
+        """
+        return max(item.date for item in self.items) if self.items else None
+
+
+class FeedItem(object):
+
+    def __init__(self, title, link, date, content):
+
+        self.title = title
+        self.link = link
+        self.date = date        # naive datetime, taken as UTC
+        self.content = content  # html
+
+
+
+def rfc822(d):
+
+    return formatdate(calendar.timegm(d.timetuple()), usegmt=True)
+
+
+def rfc3339(d):
+
+    return d.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def cdata(s):
+
+    return u'<![CDATA[%s]]>' % s.replace(u']]>', u']]]]><![CDATA[>')
+
+
+
+def write_feed(out, feed, format, encoding='utf-8'):
+    """
+    Writes feed to file-like object out, one item at a time.
+    """
+    writers = {
+        RSS: write_rss,
+        ATOM: write_atom,
+        JSON: write_json,
+    }
+
+    def write(s):
+        out.write(s.encode(encoding))
+
+    writers[format](write, feed, encoding)
+
+
+def write_rss(write, feed, encoding):
+
+    write(u'<?xml version="1.0" encoding="%s"?>\n' % encoding)
+    write(u'<rss xmlns:content="http://purl.org/rss/1.0/modules/content/" version="2.0"><channel>')
+    write(u'<title>%s</title>' % escape(feed.title))
+    write(u'<link>%s</link>' % escape(feed.link))
+    write(u'<description>%s</description>' % escape(feed.description))
+    if feed.updated():
+        write(u'<lastBuildDate>%s</lastBuildDate>' % rfc822(feed.updated()))
+    write(u'<generator>Ristretto</generator>')
+    write(u'<docs>http://blogs.law.harvard.edu/tech/rss</docs>')
+
+    for item in feed.items:
+        write(u'<item>')
+        write(u'<title>%s</title>' % escape(item.title))
+        write(u'<link>%s</link>' % escape(item.link))
+        write(u'<description>%s</description>' % cdata(item.content))
+        write(u'<content:encoded>%s</content:encoded>' % cdata(item.content))
+        write(u'<guid isPermaLink="true">%s</guid>' % escape(item.link))
+        write(u'<pubDate>%s</pubDate>' % rfc822(item.date))
+        write(u'</item>')
+
+    write(u'</channel></rss>')
+
+
+def write_atom(write, feed, encoding):
+
+    write(u'<?xml version="1.0" encoding="%s"?>\n' % encoding)
+    write(u'<feed xmlns="http://www.w3.org/2005/Atom">')
+    write(u'<title>%s</title>' % escape(feed.title))
+    write(u'<subtitle>%s</subtitle>' % escape(feed.description))
+    write(u'<link href=%s/>' % quoteattr(feed.link))
+    write(u'<link rel="self" href=%s/>' % quoteattr(feed.feed_url))
+    write(u'<id>%s</id>' % escape(feed.feed_url))
+    if feed.updated():
+        write(u'<updated>%s</updated>' % rfc3339(feed.updated()))
+    if feed.author:
+        write(u'<author><name>%s</name></author>' % escape(feed.author))
+    write(u'<generator>Ristretto</generator>')
+
+    for item in feed.items:
+        write(u'<entry>')
+        write(u'<title>%s</title>' % escape(item.title))
+        write(u'<link href=%s/>' % quoteattr(item.link))
+        write(u'<id>%s</id>' % escape(item.link))
+        write(u'<published>%s</published>' % rfc3339(item.date))
+        write(u'<updated>%s</updated>' % rfc3339(item.date))
+        write(u'<content type="html">%s</content>' % escape(item.content))
+        write(u'</entry>')
+
+    write(u'</feed>')
+
+
+def write_json(write, feed, encoding):
+
+    def dumps(data):
+        return json.dumps(data, sort_keys=True)
+
+    write(u'{"version": "https://jsonfeed.org/version/1.1"')
+    write(u', "title": %s' % dumps(feed.title))
+    write(u', "home_page_url": %s' % dumps(feed.link))
+    write(u', "feed_url": %s' % dumps(feed.feed_url))
+    write(u', "description": %s' % dumps(feed.description))
+    write(u', "items": [')
+
+    for i, item in enumerate(feed.items):
+        if i:
+            write(u', ')
+        write(dumps({
+            'id': item.link,
+            'url': item.link,
+            'title': item.title,
+            'content_html': item.content,
+            'date_published': rfc3339(item.date),
+        }))
+
+    write(u']}\n')
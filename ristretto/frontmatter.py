@@ -0,0 +1,263 @@
+# coding: utf-8
+
+
+import re
+
+import yaml
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+
+# Header delimiter: three or more dashes
+DELIMITER = '---'
+_dashes = re.compile('-*')
+
+# Header lines handled by parse_simple_header
+_key_line = re.compile(r'^([A-Za-z_][A-Za-z0-9_]*):(?: +(.*))?$')
+_item_line = re.compile(r'^( *)- +(.*)$')
+
+# Plain scalars starting with these, or containing tabs, comments or 
+# mappings, are left to yaml
+_indicators = u'-?:,[]{}#&*!|>\'"%@`'
+
+# Single line quoted scalars
+_single_quoted = re.compile(r"^'((?:[^']|'')*)'$")
+_double_quoted = re.compile(r'^"((?:[^"\\]|\\.)*)"$')
+_escape = re.compile(r'\\(x[0-9A-Fa-f]{2}|u[0-9A-Fa-f]{4}|U[0-9A-Fa-f]{8}|.)')
+
+_resolver = yaml.resolver.Resolver()
+_constructor = yaml.constructor.SafeConstructor()
+
+# Types of plain scalars parse_simple_header constructs
+_simple_tags = set([
+    u'tag:yaml.org,2002:str',
+    u'tag:yaml.org,2002:int',
+    u'tag:yaml.org,2002:float',
+    u'tag:yaml.org,2002:bool',
+    u'tag:yaml.org,2002:null',
+    u'tag:yaml.org,2002:timestamp',
+])
+
+
+class FrontMatter(object):
+    """
+    Header of a post file.
+
+    Args:
+        header
+            text between the header delimiters.
+        rest
+            text following the closing delimiter in its line.
+        offset
+            byte offset of the line after the closing delimiter, where the
+            post content continues.
+    """
+
+    def __init__(self, header, rest, offset):
+
+        self.header = header
+        self.rest = rest
+        self.offset = offset
+
+
+
+def split_delimiter(line):
+    """
+    Returns (text before, text after) the first delimiter in line, or None
+    if line has no delimiter.
+    """
+    i = line.find(DELIMITER)
+    if i == -1:
+        return None
+
+    return line[:i], line[_dashes.match(line, i).end():]
+
+
+def read_front_matter(fname, encoding):
+    """
+    Reads the header of post fname, stopping at the closing delimiter, so
+    the post content is not read.  Returns a FrontMatter, or None if fname
+    has no header.
+
+    Lines are right-stripped and text before the opening delimiter is
+    ignored.
+    """
+    header = None
+    offset = 0
+
+    with open(fname, 'rb') as f:
+        for data in iter(f.readline, b''):
+            offset += len(data)
+
+            # split as a text file would, also on unicode line breaks
+            lines = [line.rstrip() for line in data.decode(encoding).splitlines()]
+
+            for i, line in enumerate(lines):
+                if header is None:
+                    split = split_delimiter(line)
+                    if split is None:
+                        continue
+                    header = []
+                    line = split[1]
+
+                split = split_delimiter(line)
+                if split is None:
+                    header.append(line)
+                    continue
+
+                header.append(split[0])
+                rest = '\n'.join([split[1]] + lines[i + 1:])
+
+                return FrontMatter('\n'.join(header), rest, offset)
+
+    return None
+
+
+def read_content(fname, front_matter, encoding):
+    """
+    Returns the content of post fname, which follows front_matter.  Lines
+    are right-stripped.
+    """
+    with open(fname, 'rb') as f:
+        f.seek(front_matter.offset)
+        text = f.read().decode(encoding)
+
+    return front_matter.rest + ''.join(u'\n' + line.rstrip() for line in text.splitlines())
+
+
+def parse_header(header):
+    """
+    Returns the data in a yaml post header.  Headers with flat key: value
+    pairs and simple lists, as written by Post.normalize(), are parsed
+    without yaml's (slower) loader; results are the same.  Raises 
+    yaml.YAMLError if the header is not valid yaml.
+    """
+    try:
+        return parse_simple_header(header)
+    except NotSimpleHeader:
+        return yaml.load(header, Loader=SafeLoader)
+
+
+
+class NotSimpleHeader(Exception):
+    pass
+
+
+def parse_simple_header(header):
+    """
+    Parses a header with lines like:
+
+        key: value
+        list_key:
+        - value
+        - value
+
+    where values are plain or single line quoted scalars.  Raises NotSimpleHeader for anything
+    else.
+    """
+    result = {}
+    items = None    # list being read
+    indent = None   # list items indentation
+
+    for line in header.split('\n'):
+        if not line:
+            continue
+
+        m = _item_line.match(line)
+        if m is not None:
+            if items is None or indent not in (None, m.group(1)):
+                raise NotSimpleHeader()
+            indent = m.group(1)
+            items.append(scalar(m.group(2)))
+            continue
+
+        m = _key_line.match(line)
+        if m is None:
+            raise NotSimpleHeader()
+
+        key = scalar(m.group(1))
+        if not isinstance(key, basestring) or key in result:
+            raise NotSimpleHeader()
+
+        if m.group(2) is None:
+            items = []
+            indent = None
+            result[key] = items
+        else:
+            items = None
+            result[key] = scalar(m.group(2))
+
+    if not result:
+        raise NotSimpleHeader()
+
+    # keys without values nor items are null
+    for key, value in result.items():
+        if value == []:
+            result[key] = None
+
+    return result
+
+
+def scalar(value):
+    """
+    Returns value constructed as a yaml plain or (single line) quoted 
+    scalar would be.
+    """
+    if value[0] == "'":
+        m = _single_quoted.match(value)
+        if m is None:
+            raise NotSimpleHeader()
+        return yaml_str(m.group(1).replace("''", "'"))
+
+    if value[0] == '"':
+        m = _double_quoted.match(value)
+        if m is None:
+            raise NotSimpleHeader()
+        return yaml_str(_escape.sub(unescape, m.group(1)))
+
+    if (value[0] in _indicators or '\t' in value or ' #' in value or 
+            ': ' in value or value.endswith(':')):
+        raise NotSimpleHeader()
+
+    if value[0] not in _resolver.yaml_implicit_resolvers:
+        # can only be a string
+        return yaml_str(value)
+
+    tag = _resolver.resolve(yaml.ScalarNode, value, (True, False))
+    if tag not in _simple_tags:
+        raise NotSimpleHeader()
+
+    try:
+        return _constructor.yaml_constructors[tag](_constructor, yaml.ScalarNode(tag, value))
+    except ValueError:
+        # i.e., invalid date; let yaml report it
+        raise NotSimpleHeader()
+
+
+def unescape(m):
+
+    code = m.group(1)
+
+    if code in yaml.scanner.Scanner.ESCAPE_REPLACEMENTS:
+        return yaml.scanner.Scanner.ESCAPE_REPLACEMENTS[code]
+
+    if code[0] in yaml.scanner.Scanner.ESCAPE_CODES and len(code) > 1:
+        try:
+            return unichr(int(code[1:], 16))
+        except ValueError:
+            pass
+
+    raise NotSimpleHeader()
+
+
+def yaml_str(value):
+    """
+    Returns value as yaml constructs strings: str if ascii, else unicode.
+    """
+    try:
+        return value.encode('ascii')
+    except UnicodeEncodeError:
+        return value
@@ -0,0 +1,335 @@
+# coding: utf-8
+
+
+import os
+import re
+import json
+import logging
+import tempfile
+import multiprocessing
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+import tools
+
+
+# Images resized, by extension
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Quality of resized jpeg and webp images
+QUALITY = 85
+
+# sizes attribute of images with srcset: images are as wide as the page
+SIZES = '100vw'
+
+# Variants written next to their image: photo-480w.jpg, photo-480w.webp
+_variant = re.compile(r'^(.*)-\d+w(\.[^./]+)$')
+
+_img = re.compile(r'<img\b[^>]*>', re.I)
+_attr = r'''\s%s\s*=\s*(?:"([^"]*)"|'([^']*)')'''
+_src = re.compile(_attr % 'src', re.I)
+_srcset = re.compile(_attr % 'srcset', re.I)
+
+
+class ImageIndex(object):
+    """
+    Persisted record of the images in the media dir (digest and size) and
+    of the images each post references, so posts' outputs depend only on
+    their images.  Resized variants of referenced images are kept in
+    cache_dir, named by source digest and width, and published next to 
+    their image.
+
+    Args:
+        widths
+            widths of the variants, for images wider than them.
+        webp
+            also publish WebP variants, including one of the full size
+            image.
+    """
+
+    def __init__(self, fname, cache_dir, widths, webp=False, *args, **kwargs):
+
+        self.fname = fname
+        self.cache_dir = cache_dir
+        self.widths = sorted(widths)
+        self.webp = webp
+
+        self.images = {}    # name -> {'digest', 'size'}
+        self.refs = {}      # post path -> [post fingerprint, image names]
+        self.changed = False
+
+        self._referenced = None # images referenced by any post
+
+        self.load()
+
+
+    def load(self):
+
+        if os.path.exists(self.fname):
+            try:
+                with open(self.fname, 'rb') as f:
+                    data = json.load(f)
+                self.images = data['images']
+                self.refs = data['refs']
+            except (ValueError, KeyError) as e:
+                logging.error("Ignoring unreadable image index %s. Error: %s." % (self.fname, e))
+
+
+    def save(self):
+
+        if not self.changed:
+            return
+
+        tools.mkdirp(os.path.dirname(self.fname))
+
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.fname), prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            json.dump({'images': self.images, 'refs': self.refs}, f)
+        os.rename(tmp, self.fname)
+
+        self.changed = False
+
+
+    def refresh(self, images):
+        """
+        Updates the index with the current images, reading the size of new
+        and changed ones.
+
+        Args:
+            images
+                list of (name, file name, digest).
+        """
+        current = {}
+
+        for name, fname, digest in images:
+            image = self.images.get(name)
+
+            if image is None or image['digest'] != digest:
+                try:
+                    size = list(Image.open(fname).size)
+                except (IOError, OSError) as e:
+                    logging.error("Could not read image %s. Error: %s." % (fname, e))
+                    continue
+                image = {'digest': digest, 'size': size}
+
+            current[name] = image
+
+        if current != self.images:
+            self.images = current
+            self.changed = True
+            self._referenced = None
+
+
+    def variants(self, name):
+        """
+        Returns a list of (width, format extension, cached file) of the
+        variants of image name.
+        """
+        image = self.images[name]
+        width = image['size'][0]
+        ext = os.path.splitext(name)[1].lower()
+
+        result = [(w, ext) for w in self.widths if w < width]
+        if self.webp:
+            result.extend((w, '.webp') for w in sorted(set(w for w in self.widths if w < width) | set([width])))
+
+        return [(w, e, self.cached(image['digest'], w, e)) for w, e in result]
+
+
+    def cached(self, digest, width, ext):
+
+        return os.path.join(self.cache_dir, digest[:2], '%s-%d%s' % (digest, width, ext))
+
+
+    def references(self, path, fingerprint, read, media_url):
+        """
+        Returns the names of the images the post at path references.
+        Posts are only read again, with read(), when their fingerprint 
+        changes.
+        """
+        cached = self.refs.get(path)
+
+        if cached is None or cached[0] != fingerprint:
+            prefix = re.escape(media_url.rstrip('/') + '/')
+            names = sorted(set(re.findall(prefix + r'''([^\s"'()<>]+)''', read())))
+            # all media files, so images added later are found
+            cached = [fingerprint, names]
+
+            self.refs[path] = cached
+            self.changed = True
+            self._referenced = None
+
+        return [n for n in cached[1] if n in self.images]
+
+
+    def referenced(self):
+        """
+        Returns the set of names of the images referenced by posts: the
+        images whose variants are published.
+        """
+        if self._referenced is None:
+            self._referenced = set(name for fingerprint, names in self.refs.itervalues() 
+                for name in names if name in self.images)
+
+        return self._referenced
+
+
+    def fingerprint(self, names):
+
+        # unicode, as names and digests loaded from the index
+        return tools.fingerprint(sorted((unicode(n), unicode(self.images[n]['digest'])) 
+            for n in names if n in self.images))
+
+
+    def prune_cache(self):
+        """
+        Removes cached variants of images no longer referenced.
+        """
+        digests = set(self.images[name]['digest'] for name in self.referenced())
+
+        for root, dirs, files in os.walk(self.cache_dir):
+            for f in files:
+                if f.split('-', 1)[0] not in digests:
+                    os.remove(os.path.join(root, f))
+
+
+    def forget_posts(self, paths):
+        """
+        Forgets references of posts not in paths.
+        """
+        for path in set(self.refs) - set(paths):
+            del self.refs[path]
+            self.changed = True
+            self._referenced = None
+
+
+    def rewrite(self, html, media_url):
+        """
+        Returns html with the <img> tags of referenced images given their 
+        size, lazy loading and a srcset with their variants (in a <picture>
+        with a WebP source, if webp).  Images only referenced by drafts have
+        no variants published, and are left as they are.
+        """
+        prefix = media_url.rstrip('/') + '/'
+        referenced = self.referenced()
+
+        def rewrite_img(m):
+            tag = m.group(0)
+
+            src = _src.search(tag)
+            if src is None:
+                return tag
+            src = src.group(1) or src.group(2)
+
+            name = src[len(prefix):] if src.startswith(prefix) else None
+            if name not in self.images or name not in referenced:
+                return tag
+
+            width, height = self.images[name]['size']
+            attrs = []
+
+            if not re.search(r'\swidth\s*=', tag, re.I):
+                attrs.append('width="%d" height="%d"' % (width, height))
+            if not re.search(r'\sloading\s*=', tag, re.I):
+                attrs.append('loading="lazy"')
+
+            variants = self.variants(name)
+            ext = os.path.splitext(name)[1].lower()
+
+            srcset = ['%s %dw' % (prefix + variant_name(name, w, e), w) for w, e, f in variants if e == ext]
+            if srcset and not _srcset.search(tag):
+                srcset.append('%s %dw' % (src, width))
+                attrs.append('srcset="%s" sizes="%s"' % (', '.join(srcset), SIZES))
+
+            result = tag
+            if attrs:
+                result = '<img %s %s' % (' '.join(attrs), tag[len('<img'):].lstrip())
+
+            webp = ['%s %dw' % (prefix + variant_name(name, w, e), w) for w, e, f in variants if e == '.webp']
+            if webp:
+                result = '<picture><source type="image/webp" srcset="%s" sizes="%s">%s</picture>' % (
+                    ', '.join(webp), SIZES, result)
+
+            return result
+
+        return _img.sub(rewrite_img, html)
+
+
+
+def variant_name(name, width, ext):
+    """
+    Returns the name of a variant of image name: 2014/photo.jpg ->
+    2014/photo-480w.jpg
+    """
+    return '%s-%dw%s' % (os.path.splitext(name)[0], width, ext)
+
+
+def is_variant(fname):
+    """
+    Returns True if fname is named as a variant of an image next to it
+    (photo-480w.jpg, with photo.jpg or photo.png).
+    """
+    m = _variant.match(fname)
+    if m is None or m.group(2).lower() not in IMAGE_EXTENSIONS + ('.webp',):
+        return False
+
+    return any(os.path.exists(m.group(1) + ext) for ext in IMAGE_EXTENSIONS + 
+        tuple(e.upper() for e in IMAGE_EXTENSIONS))
+
+
+def resize(task):
+    """
+    Writes a variant of an image.  Runs in worker processes.
+
+    Args:
+        task
+            (source file name, destination file name, width).  The format
+            is given by the destination's extension.
+    """
+    source, dest, width = task
+
+    image = Image.open(source)
+    if image.size[0] > width:
+        height = max(1, int(round(image.size[1] * width / float(image.size[0]))))
+        image = image.resize((width, height), Image.ANTIALIAS)
+
+    ext = os.path.splitext(dest)[1].lower()
+    if ext in ('.jpg', '.jpeg') and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    elif ext == '.webp' and image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+
+    tools.mkdirp(os.path.dirname(dest))
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dest), prefix='.tmp-')
+    with os.fdopen(fd, 'wb') as f:
+        if ext == '.png':
+            image.save(f, 'PNG', optimize=True)
+        elif ext == '.webp':
+            image.save(f, 'WEBP', quality=QUALITY)
+        else:
+            image.save(f, 'JPEG', quality=QUALITY, optimize=True, progressive=True)
+    os.rename(tmp, dest)
+
+
+def resize_all(tasks):
+    """
+    Writes the variants of tasks (see resize()) using a process per cpu.
+    """
+    if len(tasks) < 2:
+        for task in tasks:
+            resize(task)
+        return
+
+    pool = multiprocessing.Pool(min(len(tasks), multiprocessing.cpu_count()))
+    try:
+        pool.map(resize, tasks, chunksize=1)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
@@ -0,0 +1,107 @@
+# coding: utf-8
+
+
+import os
+import json
+import logging
+import tempfile
+
+import tools
+
+
+class BuildManifest(object):
+    """
+    Persisted record of the files written by the build and the inputs each
+    one was rendered from.
+
+    For every output the manifest keeps a dict of dependencies: input name
+    (source file, templates, settings, navigation...) to a fingerprint of
+    that input.  An output is up to date when its file exists and its
+    dependencies are the same as when it was last written.
+
+    Paths are stored relative to base_dir.
+    """
+
+    def __init__(self, fname, base_dir, *args, **kwargs):
+
+        self.fname = fname
+        self.base_dir = base_dir
+
+        self.outputs = {}       # output path -> dependencies
+        self.produced = set()   # outputs recorded since last collect_garbage()
+
+        self.load()
+
+
+    def load(self):
+
+        self.outputs = {}
+
+        if os.path.exists(self.fname):
+            try:
+                with open(self.fname, 'rb') as f:
+                    self.outputs = json.load(f)['outputs']
+            except (ValueError, KeyError) as e:
+                logging.error("Ignoring unreadable build manifest %s. Error: %s." % (self.fname, e))
+
+
+    def save(self):
+
+        tools.mkdirp(os.path.dirname(self.fname))
+
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.fname), prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            json.dump({'outputs': self.outputs}, f, sort_keys=True)
+        os.rename(tmp, self.fname)
+
+
+    def relpath(self, fname):
+
+        return os.path.relpath(fname, self.base_dir)
+
+
+    def is_fresh(self, fname, deps):
+        """
+        Returns True if output fname exists and was built from deps.
+        """
+        return self.outputs.get(self.relpath(fname)) == deps and os.path.exists(fname)
+
+
+    def record(self, fname, deps):
+        """
+        Records output fname as produced by this build from deps.
+        """
+        key = self.relpath(fname)
+
+        self.outputs[key] = deps
+        self.produced.add(key)
+
+
+    def collect_garbage(self, sidecars=()):
+        """
+        Removes outputs written by previous builds that were not produced by
+        this one (i.e., after a slug or tag rename).  Must be called only
+        after a full build.
+
+        Args:
+            sidecars
+                extensions of files derived from outputs (i.e., '.gz'), 
+                removed with them.
+        """
+        for key in sorted(set(self.outputs) - self.produced):
+            fname = os.path.join(self.base_dir, key)
+
+            for f in [fname] + [fname + ext for ext in sidecars]:
+                if os.path.exists(f):
+                    os.remove(f)
+                    logging.info("Removed stale output %s." % f)
+
+            # remove directories left empty
+            d = os.path.dirname(fname)
+            while d != self.base_dir and os.path.isdir(d) and not os.listdir(d):
+                os.rmdir(d)
+                d = os.path.dirname(d)
+
+            del self.outputs[key]
+
+        self.produced = set()
@@ -0,0 +1,194 @@
+# coding: utf-8
+
+
+import os
+import json
+import time
+import resource
+import tempfile
+import contextlib
+
+import tools
+
+
+# Number of slowest posts reported
+SLOWEST_POSTS = 10
+
+
+class BuildMetrics(object):
+    """
+    Measures a build: wall and cpu time of each phase, counters (posts
+    parsed, markdown and template renders, files and bytes written...),
+    peak memory and the time taken to render each post.
+
+    Worker processes measure their own counters and renders; the parent
+    merges them with merge(pop()).
+    """
+
+    def __init__(self, *args, **kwargs):
+
+        self.start = time.time()
+        self.phases = []        # (name, wall, cpu, counters)
+        self.counters = {}      # name -> count, for the whole build
+        self.renders = {}       # post file name -> seconds rendering it
+
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Records the time taken by the code in the with block, and the
+        counters incremented by it.
+        """
+        counters = dict(self.counters)
+        wall = time.time()
+        cpu = cpu_time()
+
+        yield
+
+        delta = dict((k, v - counters.get(k, 0)) for k, v in self.counters.iteritems()
+            if v != counters.get(k, 0))
+        self.phases.append((name, time.time() - wall, cpu_time() - cpu, delta))
+
+
+    def count(self, name, n=1):
+
+        self.counters[name] = self.counters.get(name, 0) + n
+
+
+    def record_render(self, fname, seconds):
+        """
+        Adds seconds to the time taken to render the post in fname (i.e.,
+        converting its markdown, and then its permalink page).
+        """
+        self.renders[fname] = self.renders.get(fname, 0) + seconds
+
+
+    def render_time(self, fname):
+
+        return self.renders.get(fname, 0)
+
+
+    def pop(self):
+        """
+        Returns and resets counters and renders.
+        """
+        result = (self.counters, self.renders)
+
+        self.counters = {}
+        self.renders = {}
+
+        return result
+
+
+    def merge(self, data):
+        """
+        Adds counters and renders returned by pop() in a worker.
+        """
+        counters, renders = data
+
+        for name, n in counters.iteritems():
+            self.count(name, n)
+        for fname, seconds in renders.iteritems():
+            self.record_render(fname, seconds)
+
+
+    def slowest(self, n=None):
+        """
+        Returns (post file name, seconds) of the n slowest posts to render
+        (all posts, slowest first, if n is None).
+        """
+        return sorted(self.renders.items(), key=lambda r: r[1], reverse=True)[:n]
+
+
+    def report(self):
+        """
+        Returns the metrics as a dict.
+        """
+        return {
+            'timestamp': self.start,
+            'wall': time.time() - self.start,
+            'cpu': cpu_time(),
+            'peak_rss': peak_rss(),
+            'phases': [{'name': name, 'wall': wall, 'cpu': cpu, 'counters': counters}
+                for name, wall, cpu, counters in self.phases],
+            'counters': self.counters,
+            'slowest_posts': [{'source': fname, 'seconds': seconds}
+                for fname, seconds in self.slowest(SLOWEST_POSTS)],
+        }
+
+
+    def write(self, dname):
+        """
+        Writes the metrics to dname, as metrics.json and as a Prometheus
+        textfile (ristretto.prom).
+        """
+        report = self.report()
+
+        write_file(os.path.join(dname, 'metrics.json'),
+            json.dumps(report, indent=2, sort_keys=True))
+        write_file(os.path.join(dname, 'ristretto.prom'), prometheus(report))
+
+
+
+def cpu_time():
+    """
+    Returns user and system time of the process and its finished children.
+    """
+    return sum(os.times()[:4])
+
+
+def peak_rss():
+    """
+    Returns the max. resident set size, in bytes, of the process and its
+    children.
+    """
+    # ru_maxrss is in kilobytes
+    return 1024 * max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def prometheus(report):
+    """
+    Returns report in Prometheus text format.
+    """
+    lines = []
+
+    def metric(name, help, samples):
+        lines.append('# HELP %s %s' % (name, help))
+        lines.append('# TYPE %s gauge' % name)
+        for labels, value in samples:
+            labels = ','.join('%s="%s"' % (k, v) for k, v in labels)
+            lines.append('%s%s %r' % (name, '{%s}' % labels if labels else '', value))
+
+    metric('ristretto_build_timestamp_seconds', 'Time the last build started.',
+        [((), report['timestamp'])])
+    metric('ristretto_build_duration_seconds', 'Wall time of the last build.',
+        [((), report['wall'])])
+    metric('ristretto_build_cpu_seconds', 'CPU time of the last build.',
+        [((), report['cpu'])])
+    metric('ristretto_build_peak_rss_bytes', 'Peak memory of the last build.',
+        [((), report['peak_rss'])])
+    metric('ristretto_build_count', 'Counters of the last build.',
+        [((('counter', name),), n) for name, n in sorted(report['counters'].items())])
+    metric('ristretto_phase_duration_seconds', 'Wall time of each phase of the last build.',
+        [((('phase', p['name']),), p['wall']) for p in report['phases']])
+    metric('ristretto_phase_cpu_seconds', 'CPU time of each phase of the last build.',
+        [((('phase', p['name']),), p['cpu']) for p in report['phases']])
+    metric('ristretto_phase_count', 'Counters of each phase of the last build.',
+        [((('phase', p['name']), ('counter', name)), n)
+            for p in report['phases'] for name, n in sorted(p['counters'].items())])
+
+    return '\n'.join(lines) + '\n'
+
+
+def write_file(fname, data):
+    """
+    Replaces fname atomically, so readers never see partial files.
+    """
+    tools.mkdirp(os.path.dirname(fname))
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(fname), prefix='.tmp-')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.chmod(tmp, 0o644)
+    os.rename(tmp, fname)
@@ -0,0 +1,50 @@
+# coding: utf-8
+
+
+import re
+
+
+# Changed when minify_html() output changes, to invalidate cached results
+VERSION = 1
+
+# Elements whose content is left as is
+_preserved = re.compile(r'<(pre|textarea|script|style)\b.*?</\1\s*>', re.S | re.I)
+
+# Comments, except conditional comments (<!--[if IE]>...)
+_comment = re.compile(r'<!--(?!\[if|<!\[endif).*?-->', re.S)
+
+# Tags (left as is, so attribute values keep their spaces) or whitespace
+_tag_or_space = re.compile(r'(<[^>]*>)|\s+')
+
+
+def minify_html(html):
+    """
+    Returns html with comments removed and each run of whitespace
+    collapsed to a single space (or a newline, if it had one).  Content of
+    pre (i.e., codehilite blocks), textarea, script and style elements is
+    not changed.
+    """
+    result = []
+    pos = 0
+
+    for m in _preserved.finditer(html):
+        result.append(minify_text(html[pos:m.start()]))
+        result.append(m.group(0))
+        pos = m.end()
+
+    result.append(minify_text(html[pos:]))
+
+    return ''.join(result)
+
+
+def minify_text(html):
+
+    return _tag_or_space.sub(_collapse, _comment.sub('', html))
+
+
+def _collapse(m):
+
+    if m.group(1):
+        return m.group(1)
+
+    return '\n' if '\n' in m.group(0) else ' '
@@ -0,0 +1,69 @@
+# coding: utf-8
+
+
+import os
+import datetime
+
+from smartypants import smartyPants as smartypants
+
+
+class Navigation(object):
+    """
+    Site navigation shown on every page: the list of blog pages and the
+    list of monthly archives.  Computed once per build from the corpus.
+    """
+
+    def __init__(self, settings, corpus, *args, **kwargs):
+
+        self.s = settings
+        self.key = self.key_for(corpus)
+
+        self.pages = self.get_pages_permalinks(corpus)
+        self.archive = self.get_monthly_archives_permalinks(months=self.key[1])
+
+
+    @staticmethod
+    def key_for(corpus):
+        """
+        Returns the data navigation depends on: pages slugs and titles, and
+        months with posts.  Navigation must be recomputed when it changes.
+        """
+        pages = tuple((p.slug, p.title) for p in corpus.pages)
+        months = tuple(corpus.months())
+
+        return (pages, months)
+
+
+    def get_pages_permalinks(self, corpus):
+        """
+        Returns a list containing blog pages. Each page is a dict:
+            'url': page permalink
+            'title': page title
+        """
+        result = []
+        for post in corpus.pages:
+            page_url = os.path.join('/', self.s.WWW_PAGES_URL, "%s%s" % (post.slug, self.s.HTML_EXT))
+            page_title = smartypants(post.title)
+            result.append({ 'url': page_url, 'title': page_title })
+
+        return result
+
+
+    def get_monthly_archives_permalinks(self, months):
+        """
+        Returns a list containing:
+            'date':  datatime stamp for month
+            'url' :  month's index permalink
+
+        Results in list are ordered by date, newest first.
+        """
+        result = []
+
+        for year, month in reversed(months):
+            permalink = os.path.join('/', "%04d" % year, "%02d" % month, self.s.ARCHIVE_PAGE)
+            result.append({
+                'url': permalink,
+                'date': datetime.date(year, month, 1)
+            })
+
+        return result
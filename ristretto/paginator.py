@@ -0,0 +1,115 @@
+# coding: utf-8
+
+
+import os
+
+
+class Page(object):
+
+    def __init__(self, number, posts, fname, prev_page_url, next_page_url):
+
+        self.number = number
+        self.posts = posts
+        self.fname = fname                  # relative to the listing's directory
+        self.prev_page_url = prev_page_url  # newer posts
+        self.next_page_url = next_page_url  # older posts
+
+
+
+class Paginator(object):
+    """
+    Splits a list of posts, newest first, into pages of per_page posts.
+
+    The first page is named page_name (i.e., index.html) and the following
+    ones get the page number appended (index-1.html, index-2.html...).
+    Page urls are relative, as all pages of a listing share a directory.
+
+    If stable is True, pages after the first one are numbered from the
+    oldest post instead: index-1.html has the oldest per_page posts,
+    index-2.html the next ones, and so on.  The first page still shows the
+    newest per_page posts.  Publishing a post then only changes the first
+    page and the newest one or two numbered pages; older pages keep their
+    content and url.
+
+    Args:
+        posts
+            list of posts, newest first.
+        per_page
+            max. number of posts in a page (POSTS_PER_PAGE).
+        page_name
+            file name of the first page.
+        stable
+            number pages from the oldest post.
+    """
+
+    def __init__(self, posts, per_page, page_name, stable=False, *args, **kwargs):
+
+        self.posts = posts
+        self.per_page = per_page
+        self.page_name = page_name
+        self.stable = stable
+
+
+    def page_fname(self, number):
+
+        if number == 0:
+            return self.page_name
+
+        name, ext = os.path.splitext(self.page_name)
+        return "%s-%d%s" % (name, number, ext)
+
+
+    def pages(self):
+        """
+        Returns the list of pages, first (newest) page first.
+        """
+        if self.stable:
+            return self.stable_pages()
+
+        count = (len(self.posts) + self.per_page - 1) // self.per_page
+        result = []
+
+        for number in range(count):
+            first_post = number * self.per_page
+
+            result.append(Page(number,
+                posts=self.posts[first_post:first_post + self.per_page],
+                fname=self.page_fname(number),
+                prev_page_url=self.page_fname(number - 1) if number > 0 else None,
+                next_page_url=self.page_fname(number + 1) if number < count - 1 else None,
+            ))
+
+        return result
+
+
+    def stable_pages(self):
+
+        posts = self.posts
+        per_page = self.per_page
+
+        if not posts:
+            return []
+
+        first_page = Page(0, posts[:per_page], self.page_name, None, None)
+
+        if len(posts) <= per_page:
+            return [first_page]
+
+        count = (len(posts) + per_page - 1) // per_page
+        result = [first_page]
+
+        # the newest numbered page only has posts also in the first page, 
+        # so older posts start in page count - 1
+        first_page.next_page_url = self.page_fname(count - 1)
+
+        for number in range(count, 0, -1):
+            last_post = len(posts) - (number - 1) * per_page
+
+            result.append(Page(number,
+                posts=posts[max(0, last_post - per_page):last_post],
+                fname=self.page_fname(number),
+                prev_page_url=self.page_fname(number + 1) if number < count else self.page_name,
+                next_page_url=self.page_fname(number - 1) if number > 1 else None,
+            ))
+
+        return result
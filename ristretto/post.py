@@ -10,6 +10,9 @@ import pprint as pp
 
 import yaml 
 import unidecode
+
+import frontmatter
+import tools
     
 
 class NotAPostException(Exception):
@@ -35,9 +38,10 @@ class Post(object):
         self.title_link = None  # post title link
         self.tags = []      # post tags
         self.categories = [] # post categories
-        self.content = None # post content as a list of lines
+        self.content = None # post content
         self.permalink = None
         self.comments = None
+        self.front_matter = None    # header read from fname
     
         if fname is not None:       
             self.parse_variables()
@@ -53,6 +57,35 @@ class Post(object):
                 self.type = self.s.POST_TYPE_POST
                 
 
+    @property
+    def content(self):
+        """
+        Post content, read from fname on first access.
+        """
+        if self._content is None and self.front_matter is not None:
+            self._content = self.read_content()
+
+        return self._content
+
+
+    @content.setter
+    def content(self, value):
+
+        self._content = value
+
+
+    def read_content(self):
+
+        if tools.file_fingerprint(self.fname) != self.source_fingerprint:
+            # file changed since its header was read, content may have moved
+            self.source_fingerprint = tools.file_fingerprint(self.fname)
+            self.front_matter = frontmatter.read_front_matter(self.fname, self.s.INPUT_ENCODING)
+            if self.front_matter is None:
+                raise NotAPostException()
+
+        return frontmatter.read_content(self.fname, self.front_matter, self.s.INPUT_ENCODING)
+
+
     def slugify(self, s):
         """
             Converts title to slug.
@@ -107,8 +140,7 @@ class Post(object):
 
     def parse_variables(self):
         """
-        Processes post parsing variables.
-        Returns a dict with variables and a list with post content.
+        Processes post parsing variables.  Only the post header is read.
         """
 
         # Recognized variables are:
@@ -118,32 +150,20 @@ class Post(object):
         # slug:   post slug
         # status: draft|published|publish
 
-        regex = re.compile("----*(?P<header>.*?)----*(?P<content>.*)",re.MULTILINE|re.DOTALL)  
-              
-        input_file = codecs.open(self.fname, mode='r', encoding=self.s.INPUT_ENCODING)
-        # Read lines stripping newline, if present
-        lines = [line.rstrip() for line in input_file]
-        input_file.close()
-        
-        s = '\n'.join(lines)
-        
-        r = regex.search(s)
-        
+        # post content is read when needed (see content)
+        self.source_fingerprint = tools.file_fingerprint(self.fname)
+        front_matter = frontmatter.read_front_matter(self.fname, self.s.INPUT_ENCODING)
 
-        if r:
-            results = r.groupdict()
-            header = results['header']
-            content = results['content']
-        else:
+        if front_matter is None:
             raise NotAPostException()
-        
-        # save post content    
-        self.content = content
+
+        header = front_matter.header
+        self.front_matter = front_matter
         
         
         # Parse header data
         try: 
-            data = yaml.load(header)
+            data = frontmatter.parse_header(header)
         except yaml.YAMLError, exc:
             r = "Error parsing post header: \nFile: {0}\nMsg: {1}".format(self.fname, exc)
             if hasattr(exc, 'problem_mark'):
@@ -250,16 +270,59 @@ class Post(object):
         """
         Rewrites post in normalized format
         """
-        outf = codecs.open(self.fname, "w", encoding=self.s.OUTPUT_ENCODING)
-        
-        outf.write(u"{0}\n".format(self.s.POST_HEADER_DELIMITER))
-        outf.write(self.build_header())
-        outf.write(u"{0}\n".format(self.s.POST_HEADER_DELIMITER))
-        
-        outf.write(u"{0}\n".format(self.content))
+        # read content before the file is truncated
+        content = self.content
+
+        # content starts with the line break after the closing delimiter
+        text = u"{0}\n{1}{0}{2}\n".format(self.s.POST_HEADER_DELIMITER, self.build_header(), content)
 
+        # leave files already normalized untouched, so watchers do not see
+        # a change each time a build normalizes them
+        with open(self.fname, 'rb') as f:
+            if f.read() == text.encode(self.s.OUTPUT_ENCODING):
+                return
+
+        outf = codecs.open(self.fname, "w", encoding=self.s.OUTPUT_ENCODING)
+        outf.write(text)
         outf.close()
 
+        # content offset changed
+        self.front_matter = None
+
+
+
+
+class RenderedPost(object):
+    """
+    Post as seen by templates, with title and content converted to html.
+    Content is only converted when a template uses it, so templates that 
+    only show post metadata never render markdown.
+
+    Args:
+        title
+            post title, converted to html.
+        render
+            function returning the content of a post as html.
+    """
+
+    def __init__(self, post, title, render, *args, **kwargs):
+
+        self.post = post
+        self.title = title
+        self.render = render
+
+
+    def __getattr__(self, name):
+
+        return getattr(self.post, name)
+
+
+    @property
+    def content(self):
+
+        return self.render(self.post)
+
+
 
 
 
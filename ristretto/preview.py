@@ -0,0 +1,268 @@
+# coding: utf-8
+
+
+import os
+import gzip
+import socket
+import logging
+import threading
+import posixpath
+import urllib
+import BaseHTTPServer
+import SimpleHTTPServer
+import SocketServer
+from email.utils import formatdate, parsedate_tz, mktime_tz
+from cStringIO import StringIO
+
+
+# URL of the server-sent events stream used for live reload
+EVENTS_URL = '/__ristretto/events'
+
+# Injected before </body> of html pages, reloads the page after a rebuild
+RELOAD_SCRIPT = """<script>
+(function() {
+    if (!window.EventSource) return;
+    var events = new EventSource('%s');
+    events.addEventListener('reload', function() { location.reload(); });
+})();
+</script>
+""" % EVENTS_URL
+
+# Content types worth compressing
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json',
+    'application/xml', 'application/rss+xml', 'image/svg+xml')
+
+
+class BuildNotifier(object):
+    """
+    Lets threads wait for the next build to finish.
+    """
+
+    def __init__(self):
+
+        self.builds = 0
+        self.condition = threading.Condition()
+
+
+    def notify(self):
+
+        with self.condition:
+            self.builds += 1
+            self.condition.notify_all()
+
+
+    def wait(self, seen, timeout):
+        """
+        Waits up to timeout seconds for a build newer than seen.  Returns
+        the number of the latest build.
+        """
+        with self.condition:
+            if self.builds == seen:
+                self.condition.wait(timeout)
+            return self.builds
+
+
+
+class PreviewRequestHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    """
+    Serves files from server.root, with support for conditional requests
+    (ETag, If-Modified-Since), gzip and live reload.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    # keep-alive messages for idle event streams
+    EVENTS_PING_INTERVAL = 15
+
+
+    def translate_path(self, path):
+
+        path = posixpath.normpath(urllib.unquote(path.split('?', 1)[0].split('#', 1)[0]))
+        result = self.server.root
+
+        for word in path.split('/'):
+            if not word or word in (os.curdir, os.pardir):
+                continue
+            result = os.path.join(result, word)
+
+        return result
+
+
+    def do_GET(self):
+
+        if self.path == EVENTS_URL:
+            self.send_events()
+        else:
+            self.send_file(head_only=False)
+
+
+    def do_HEAD(self):
+
+        self.send_file(head_only=True)
+
+
+    def send_file(self, head_only):
+
+        fname = self.translate_path(self.path)
+
+        if os.path.isdir(fname):
+            if not self.path.split('?', 1)[0].endswith('/'):
+                self.send_response(301)
+                self.send_header('Location', self.path + '/')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            fname = os.path.join(fname, 'index.html')
+
+        try:
+            st = os.stat(fname)
+        except OSError:
+            self.send_error(404, "File not found")
+            return
+
+        with open(fname, 'rb') as f:
+            body = f.read()
+
+        self.send_content(body, self.guess_type(fname), 
+            version='%x-%x' % (int(st.st_mtime * 1000000), st.st_size),
+            mtime=int(st.st_mtime),
+            head_only=head_only)
+
+
+    def send_content(self, body, ctype, version, mtime, head_only):
+        """
+        Sends body, or a 304 response if the client has it cached.
+
+        Args:
+            version
+                string that changes whenever body changes, used for ETag.
+            mtime
+                body's last modification time.
+        """
+        compress = ('gzip' in self.headers.get('Accept-Encoding', '') and
+            ctype.startswith(COMPRESSIBLE_TYPES))
+        reload = self.server.live_reload and ctype == 'text/html'
+
+        etag = '"%s%s%s"' % (version, '-gz' if compress else '', '-lr' if reload else '')
+        last_modified = formatdate(mtime, usegmt=True)
+
+        if self.not_modified(etag, mtime):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+            self.end_headers()
+            return
+
+        if reload:
+            i = body.rfind('</body>')
+            if i == -1:
+                i = len(body)
+            body = body[:i] + RELOAD_SCRIPT + body[i:]
+
+        if compress:
+            buf = StringIO()
+            gz = gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=6, mtime=0)
+            gz.write(body)
+            gz.close()
+            body = buf.getvalue()
+
+        self.send_response(200)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', last_modified)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
+        if compress:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+
+        if not head_only:
+            self.wfile.write(body)
+
+
+    def not_modified(self, etag, mtime):
+        """
+        Returns True if the client's cached copy is still valid.
+        """
+        if 'If-None-Match' in self.headers:
+            tags = [t.strip() for t in self.headers['If-None-Match'].split(',')]
+            return etag in tags or '*' in tags
+
+        if 'If-Modified-Since' in self.headers:
+            since = parsedate_tz(self.headers['If-Modified-Since'])
+            if since is not None:
+                return mtime <= mktime_tz(since)
+
+        return False
+
+
+    def send_events(self):
+        """
+        Streams a 'reload' server-sent event each time a build finishes.
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = 1
+
+        notifier = self.server.notifier
+        seen = notifier.builds
+
+        try:
+            while True:
+                builds = notifier.wait(seen, self.EVENTS_PING_INTERVAL)
+                if builds != seen:
+                    seen = builds
+                    self.wfile.write('event: reload\ndata: %d\n\n' % builds)
+                else:
+                    self.wfile.write(': ping\n\n')
+                self.wfile.flush()
+        except (socket.error, IOError):
+            # client went away
+            pass
+
+
+    def address_string(self):
+
+        # skip reverse DNS lookup
+        return self.client_address[0]
+
+
+    def log_message(self, format, *args):
+
+        logging.info("Preview server: %s - %s" % (self.address_string(), format % args))
+
+
+
+class PreviewServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Threaded http server for previewing the blog in root directory.  Set
+    live_reload to True and call notifier.notify() after each build to
+    reload open pages.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    handler_class = PreviewRequestHandler
+
+    def __init__(self, address, root, live_reload=False):
+
+        BaseHTTPServer.HTTPServer.__init__(self, address, self.handler_class)
+
+        self.root = root
+        self.live_reload = live_reload
+        self.notifier = BuildNotifier()
+
+
+    def serve_in_background(self):
+
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        return thread
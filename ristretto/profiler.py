@@ -0,0 +1,93 @@
+# coding: utf-8
+
+
+import os
+import signal
+import cProfile
+import contextlib
+
+import tools
+
+
+# Seconds of cpu time between stack samples
+SAMPLE_INTERVAL = 0.001
+
+
+class BuildProfiler(object):
+    """
+    Profiles build phases.  For each phase, writes the cProfile statistics
+    to <phase>.pstats in dname (read them with pstats or snakeviz).  The
+    stacks of all phases are also sampled and written to stacks.txt in
+    collapsed format, one line per stack with its number of samples, for
+    flamegraph tools (flamegraph.pl, speedscope).  Sampled stacks start
+    with the phase name.
+
+    Only profiles the process it runs in: build with a single process.
+    Sampling uses SIGPROF, so phases must run in the main thread.
+    """
+
+    def __init__(self, dname, interval=SAMPLE_INTERVAL, *args, **kwargs):
+
+        self.dname = dname
+        self.interval = interval
+
+        self.stacks = {}        # collapsed stack -> samples
+        self.current = None     # name of the phase being profiled
+
+        tools.mkdirp(dname)
+
+
+    def reset(self):
+        """
+        Forgets stacks sampled in previous builds.
+        """
+        self.stacks = {}
+
+
+    @contextlib.contextmanager
+    def phase(self, name):
+
+        profile = cProfile.Profile()
+
+        self.current = name
+        previous = signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        profile.enable()
+
+        try:
+            yield
+        finally:
+            profile.disable()
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, previous)
+            self.current = None
+
+            profile.dump_stats(os.path.join(self.dname, '%s.pstats' % name))
+            self.write_stacks()
+
+
+    def sample(self, signum, frame):
+
+        stack = []
+        while frame is not None:
+            # compiled templates have no module name: use template file name
+            module = frame.f_globals.get('__name__') or os.path.basename(frame.f_code.co_filename)
+            stack.append('%s.%s' % (module, frame.f_code.co_name))
+            frame = frame.f_back
+
+        stack.append(self.current)
+        stack.reverse()
+
+        # drop the frames of the profiler itself
+        if stack[-1] == '%s.%s' % (__name__, 'phase'):
+            return
+
+        key = ';'.join(stack)
+        self.stacks[key] = self.stacks.get(key, 0) + 1
+
+
+    def write_stacks(self):
+
+        with open(os.path.join(self.dname, 'stacks.txt'), 'wb') as f:
+            for stack, samples in sorted(self.stacks.iteritems()):
+                f.write('%s %d\n' % (stack, samples))
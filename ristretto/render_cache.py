@@ -0,0 +1,147 @@
+# coding: utf-8
+
+
+import os
+import hashlib
+import logging
+import tempfile
+from collections import OrderedDict
+
+import tools
+
+
+class RenderCache(object):
+    """
+    Persistent cache of rendered markdown (or of other text transformations,
+    i.e. minified html).
+
+    Entries are stored one per file under cache_dir, keyed by a hash of the
+    source text and salt (a string describing the markdown settings used
+    for rendering).  Every cache hit touches its file, so file mtimes give
+    the LRU order used by prune() to keep the cache under max_size bytes.
+
+    Args:
+        memory
+            also keep entries used in memory, for the life of the process,
+            up to memory_max_size characters (least recently used entries
+            are dropped first).
+    """
+
+    def __init__(self, cache_dir, max_size, salt='', memory=True, 
+            memory_max_size=16 * 1024 * 1024):
+
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.salt = salt.encode('utf-8')
+
+        # entries used during this process, least recently used first
+        self.memory = OrderedDict() if memory else None
+        self.memory_size = 0
+        self.memory_max_size = memory_max_size
+        self.hits = 0
+        self.misses = 0
+
+
+    def key(self, text):
+
+        return hashlib.sha1(self.salt + b'\0' + text.encode('utf-8')).hexdigest()
+
+
+    def path(self, key):
+
+        return os.path.join(self.cache_dir, key[:2], key)
+
+
+    def get(self, text, render):
+        """
+        Returns the rendered version of text, calling render(text) only if
+        text is not in the cache.
+        """
+        key = self.key(text)
+
+        if self.memory is not None and key in self.memory:
+            self.hits += 1
+            # mark as recently used
+            result = self.memory.pop(key)
+            self.memory[key] = result
+            return result
+
+        fname = self.path(key)
+
+        try:
+            with open(fname, 'rb') as f:
+                result = f.read().decode('utf-8')
+            # mark as recently used
+            os.utime(fname, None)
+            self.hits += 1
+
+        except (IOError, OSError):
+            result = render(text)
+            self.store(fname, result)
+            self.misses += 1
+
+        if self.memory is not None:
+            self.remember(key, result)
+
+        return result
+
+
+    def remember(self, key, result):
+        """
+        Keeps result in memory, dropping least recently used entries to stay
+        under memory_max_size.
+        """
+        self.memory[key] = result
+        self.memory_size += len(result)
+
+        while self.memory_size > self.memory_max_size and len(self.memory) > 1:
+            old_key, old = self.memory.popitem(last=False)
+            self.memory_size -= len(old)
+
+
+    def store(self, fname, html):
+
+        dname = os.path.dirname(fname)
+        tools.mkdirp(dname)
+
+        # write to a temp file and rename, so concurrent builds never
+        # see partial entries
+        fd, tmp = tempfile.mkstemp(dir=dname, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(html.encode('utf-8'))
+            os.rename(tmp, fname)
+        except (IOError, OSError) as e:
+            logging.error("Could not write render cache entry %s. Error: %s." % (fname, e))
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+
+    def prune(self):
+        """
+        Removes least recently used entries until the cache fits in max_size.
+        """
+        entries = []
+        total = 0
+
+        for root, dirs, files in os.walk(self.cache_dir):
+            for f in files:
+                fname = os.path.join(root, f)
+                st = os.stat(fname)
+                entries.append((st.st_mtime, st.st_size, fname))
+                total += st.st_size
+
+        if total <= self.max_size:
+            return
+
+        entries.sort()
+        removed = 0
+
+        for mtime, size, fname in entries:
+            if total <= self.max_size:
+                break
+            os.remove(fname)
+            total -= size
+            removed += 1
+
+        logging.info("Removed %d entries from render cache." % removed)
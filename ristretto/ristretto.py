@@ -22,7 +22,32 @@ usage: ristretto.py [options]
     
     Other:
     -v                          Launch local web server for previewing blog.
-    --preview    
+    --preview                   With --watch, pages reload after each rebuild.
+
+    -d                          Launch local web server that renders each page
+    --dev                       when requested, without building the blog.
+
+    --port=N                    Port for the preview server (default 8000).
+
+    -f                          Rebuild all files, even if they are up to date.
+    --force
+
+    -j N                        Render using N processes.
+    --jobs=N
+
+    -w                          After building, keep running and rebuild 
+    --watch                     when drafts, posts, pages or templates change.
+
+    --profile=DIR               Profile each build phase: write DIR/<phase>.pstats
+                                (cProfile) and DIR/stacks.txt (sampled stacks, 
+                                collapsed for flamegraph tools).  Builds in a 
+                                single process.
+    --profile-posts=N           With --profile, also profile rendering again
+                                the N slowest posts (DIR/posts.pstats).
+
+    --metrics=DIR               After each build, write build metrics to
+                                DIR/metrics.json and DIR/ristretto.prom
+                                (Prometheus textfile).
     
     """)
     sys.exit()
@@ -35,20 +60,27 @@ if __name__=='__main__':
     import getopt
     import importlib
     import logging
-    import SimpleHTTPServer
-    import SocketServer
     
     import updater
+    from preview import PreviewServer
+    from devserver import DevServer
 
     # Parse command line arguments
     argv = sys.argv[1:]
     settings_file = None
     preview = None
     port = None
+    force = False
+    jobs = 1
+    watch = False
+    dev = False
+    metrics_dir = None
+    profile_dir = None
+    profile_posts = 0
     
     try:
         opts, args = getopt.getopt(argv,
-            "hs:vp=", ["help", "settings=", "preview", "port="]
+            "hs:vp=fj:wd", ["help", "settings=", "preview", "port=", "force", "jobs=", "watch", "dev", "metrics=", "profile=", "profile-posts="]
         )
     except getopt.GetoptError:
         usage()
@@ -64,6 +96,20 @@ if __name__=='__main__':
             preview = True
         elif opt in ("-p", "--port"):
             port = arg
+        elif opt in ("-f", "--force"):
+            force = True
+        elif opt in ("-j", "--jobs"):
+            jobs = int(arg)
+        elif opt in ("-w", "--watch"):
+            watch = True
+        elif opt in ("-d", "--dev"):
+            dev = True
+        elif opt == "--metrics":
+            metrics_dir = os.path.abspath(arg)
+        elif opt == "--profile":
+            profile_dir = os.path.abspath(arg)
+        elif opt == "--profile-posts":
+            profile_posts = int(arg)
         
             
             
@@ -81,27 +127,45 @@ if __name__=='__main__':
         exit(1)
 
         
+    logging.basicConfig(filename=settings.LOG_FILE, level=logging.INFO, format='%(asctime)s %(message)s')
+    logging.info('----------------')
+    logging.info('Logging started.')
+
+    server = None
+
+    if port:
+        PORT = int(port)
+    else:
+        PORT = 8000
+
+    if dev:
+        server = DevServer(("", PORT), updater.Updater(settings=settings))
+        print("Ristretto rendering pages on request at port {0}.  Visit http://localhost:{0} to preview your blog. \nCtrl-C to end server.".format(PORT))
+        server.serve_forever()
+
     if preview:
-        if port:
-            PORT = int(port)
-        else:
-            PORT = 8000
-        
-        Handler = SimpleHTTPServer.SimpleHTTPRequestHandler
-        httpd = SocketServer.TCPServer(("", PORT), Handler)
+        # with --watch, open pages reload after each build
+        server = PreviewServer(("", PORT), settings.WWW_DIR, live_reload=watch)
     
-        os.chdir(settings.WWW_DIR)    
         print("Ristretto serving at port {0}.  Visit http://localhost:{0} to preview your blog. \nCtrl-C to end server.".format(PORT))
-        httpd.serve_forever()
-        
-        
-
 
+        if not watch:
+            server.serve_forever()
 
-    logging.basicConfig(filename=settings.LOG_FILE, level=logging.INFO, format='%(asctime)s %(message)s')
-    logging.info('----------------')
-    logging.info('Logging started.')
-    
-    updater.Updater(settings=settings).update()
+        server.serve_in_background()
     
-        
+    if profile_dir and jobs > 1:
+        # workers are not profiled
+        print("Profiling: rendering using a single process.")
+        jobs = 1
+
+    u = updater.Updater(settings=settings, jobs=jobs, metrics_dir=metrics_dir,
+        profile_dir=profile_dir, profile_posts=profile_posts)
+    u.update(force_publish=force)
+
+    if watch:
+        print("Ristretto watching for changes.  Ctrl-C to stop.")
+        try:
+            u.watch(on_build=server.notifier.notify if server else None)
+        except KeyboardInterrupt:
+            pass
@@ -64,3 +64,46 @@ TAGGED_PAGE = 'index.html'
 # Error pages
 ERR_404_PAGE = '404.html'
 ERR_500_PAGE = '500.html'
+
+
+#
+# Optional settings (defaults are in base_settings.py)
+#
+
+# Max size in bytes of the rendered markdown cache
+# RENDER_CACHE_MAX_SIZE = 64 * 1024 * 1024
+
+# Number of posts in feeds, and whether to publish feeds for each tag
+# FEED_ITEMS = 20
+# TAG_FEEDS = True
+
+# Author named in Atom feeds, if not BLOG_TITLE
+# BLOG_AUTHOR = 'Yours Truly'
+
+# Number index, tag and monthly archive pages from the oldest post, so
+# that older pages never change when posts are published
+# PAGINATION_STABLE = False
+
+# Write a gzip compressed copy (.gz) of each html, xml and json output and
+# each static file, for web servers serving precompressed files (i.e.,
+# nginx gzip_static)
+# GZIP_OUTPUTS = False
+
+# Minify rendered html: remove comments and collapse whitespace, leaving
+# pre (i.e., code blocks), script, style and textarea elements as they are
+# MINIFY_HTML = False
+
+# Publish these stylesheets with only the rules used by the pages (templates
+# link them with asset_url()), keeping rules for classes, ids and tags only
+# added by scripts.  Optionally, inline in each page the rules used above
+# the fold and load the stylesheets without blocking rendering.
+# PRUNE_CSS = ['css/bootstrap.min.css', 'css/bootstrap-responsive.min.css', 'css/codehilite.css']
+# PRUNE_CSS_KEEP = ['.open', '.in', '.active', '.collapse', '.fade']
+# INLINE_CRITICAL_CSS = False
+
+# Publish resized variants (widths in pixels, optionally also WebP) of the
+# images in the media dir used by posts, and give their <img> tags a srcset,
+# their size and lazy loading.  Requires Pillow (pip install Pillow).
+# RESPONSIVE_IMAGES = False
+# IMAGE_WIDTHS = [480, 960, 1440]
+# IMAGE_WEBP = False
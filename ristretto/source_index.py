@@ -0,0 +1,287 @@
+# coding: utf-8
+
+
+import os
+import re
+import sqlite3
+import logging
+import cPickle as pickle
+
+from post import Post
+import tools
+
+
+# Posts file names start with YYYYMMDD-p##, the sequence number of the
+# post in its day
+_sequenced = re.compile(r'^(\d{8})-.(\d\d)')
+
+SCHEMA = """
+CREATE TABLE meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+
+CREATE TABLE sources (
+    path TEXT PRIMARY KEY,      -- relative to base_dir
+    kind TEXT NOT NULL,         -- 'post' or 'page'
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT NOT NULL,         -- sha1 of file content
+    name TEXT NOT NULL,         -- file name, orders posts with the same date
+    slug TEXT,
+    date TEXT,                  -- YYYY-MM-DD HH:MM:SS
+    month TEXT,                 -- YYYY-MM
+    day TEXT,                   -- YYYYMMDD, from file name
+    sequence INTEGER,           -- from file name
+    status TEXT,
+    layout TEXT,
+    post BLOB NOT NULL          -- pickled Post
+);
+
+CREATE INDEX sources_date ON sources (kind, date, name);
+CREATE INDEX sources_month ON sources (kind, month);
+CREATE INDEX sources_day ON sources (day);
+
+CREATE TABLE tags (
+    path TEXT NOT NULL,
+    tag TEXT NOT NULL
+);
+
+CREATE INDEX tags_tag ON tags (tag);
+CREATE INDEX tags_path ON tags (path);
+
+CREATE TABLE categories (
+    path TEXT NOT NULL,
+    category TEXT NOT NULL
+);
+
+CREATE INDEX categories_category ON categories (category);
+CREATE INDEX categories_path ON categories (path);
+"""
+
+
+class SourceIndex(object):
+    """
+    Persistent index of the blog sources (posts and pages), kept in a
+    SQLite database.
+
+    Each source file has a row with its stat data, content hash, header
+    metadata and parsed post, so a build only parses the files that
+    changed since the previous one.  Post ordering, months, tags and
+    sequence numbers are answered with indexed queries.
+
+    Paths are stored relative to base_dir.
+
+    Args:
+        salt
+            the index is rebuilt when it changes (i.e., settings posts are
+            parsed with).
+    """
+
+    # Changed when the schema or the stored posts change
+    VERSION = 1
+
+    def __init__(self, fname, base_dir, salt='', *args, **kwargs):
+
+        self.fname = fname
+        self.base_dir = base_dir
+
+        tools.mkdirp(os.path.dirname(fname))
+
+        # callers serialize access to the index (see DevServer)
+        self.db = sqlite3.connect(fname, check_same_thread=False)
+        self.db.text_factory = str
+
+        self.open(tools.fingerprint((self.VERSION, salt)))
+
+
+    def open(self, version):
+        """
+        Creates the database tables, dropping the existing ones if they
+        are from another version.
+        """
+        try:
+            row = self.db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        except sqlite3.DatabaseError:
+            row = None
+
+        if row is not None and row[0] == version:
+            return
+
+        if row is not None:
+            logging.info("Rebuilding source index %s." % self.fname)
+
+        with self.db:
+            for (table,) in self.db.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+                self.db.execute("DROP TABLE %s" % table)
+
+            self.db.executescript(SCHEMA)
+            self.db.execute("INSERT INTO meta (key, value) VALUES ('version', ?)", (version,))
+
+
+    def relpath(self, fname):
+
+        return os.path.relpath(fname, self.base_dir)
+
+
+    def abspath(self, path):
+
+        return os.path.join(self.base_dir, path)
+
+
+    def refresh(self, sources, parse):
+        """
+        Updates the index with the current state of the source files.
+        New files, and files whose content changed, are parsed; rows of
+        files that no longer exist are removed.  Returns the number of
+        files parsed.
+
+        Args:
+            sources
+                list of (file name, kind) of all the sources.
+            parse
+                function returning the post in a file.
+        """
+        indexed = dict((row[0], row[1:]) for row in
+            self.db.execute("SELECT path, mtime, size, hash FROM sources"))
+
+        parsed = 0
+        seen = set()
+
+        with self.db:
+            for fname, kind in sources:
+                path = self.relpath(fname)
+                seen.add(path)
+
+                st = os.stat(fname)
+                row = indexed.get(path)
+
+                if row is not None and row[:2] == (st.st_mtime, st.st_size):
+                    continue
+
+                digest = tools.file_hash(fname)
+
+                if row is not None and row[2] == digest:
+                    # touched, but same content
+                    self.db.execute("UPDATE sources SET mtime = ?, size = ? WHERE path = ?",
+                        (st.st_mtime, st.st_size, path))
+                    continue
+
+                self.store(path, kind, st, digest, parse(fname))
+                parsed += 1
+
+            for path in set(indexed) - seen:
+                self.delete(path)
+
+        return parsed
+
+
+    def store(self, path, kind, st, digest, post):
+
+        self.delete(path)
+
+        state = dict(post.__dict__)
+        del state['s']                  # settings module
+        state['_content'] = None        # read again when needed
+
+        name = os.path.basename(path)
+        day, sequence = file_sequence(name)
+
+        self.db.execute("""INSERT INTO sources (path, kind, mtime, size, hash, name, slug,
+                date, month, day, sequence, status, layout, post)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", (
+                path, kind, st.st_mtime, st.st_size, digest, name,
+                post.slug,
+                post.date.isoformat(' '), "%04d-%02d" % (post.date.year, post.date.month),
+                day, sequence,
+                post.status, post.layout,
+                sqlite3.Binary(pickle.dumps(state, pickle.HIGHEST_PROTOCOL)),
+            ))
+
+        self.db.executemany("INSERT INTO tags (path, tag) VALUES (?, ?)",
+            [(path, unicode(tag).strip()) for tag in post.tags or []])
+        self.db.executemany("INSERT INTO categories (path, category) VALUES (?, ?)",
+            [(path, unicode(c).strip()) for c in post.categories or []])
+
+
+    def delete(self, path):
+
+        for table in ('sources', 'tags', 'categories'):
+            self.db.execute("DELETE FROM %s WHERE path = ?" % table, (path,))
+
+
+    def posts(self, kind):
+        """
+        Returns (file name, fingerprint, post state) of every source of
+        kind, posts newest first.  Post state is restored with load_post().
+        """
+        return [(self.abspath(path), tools.stat_fingerprint(mtime, size), state)
+            for path, mtime, size, state in self.db.execute(
+                """SELECT path, mtime, size, post FROM sources WHERE kind = ?
+                ORDER BY date DESC, name DESC""", (kind,))]
+
+
+    def months(self):
+        """
+        Returns a sorted list of (year, month) with posts.
+        """
+        return [tuple(int(x) for x in month.split('-')) for (month,) in self.db.execute(
+            "SELECT DISTINCT month FROM sources WHERE kind = 'post' ORDER BY month")]
+
+
+    def tagged(self):
+        """
+        Returns a list of (tag, file names of posts with tag, newest first),
+        sorted by tag.
+        """
+        result = []
+
+        for tag, path in self.db.execute("""SELECT tags.tag, sources.path
+                FROM tags JOIN sources ON tags.path = sources.path
+                WHERE sources.kind = 'post'
+                ORDER BY tags.tag, sources.date DESC, sources.name DESC"""):
+            tag = text(tag)
+            if not result or result[-1][0] != tag:
+                result.append((tag, []))
+            result[-1][1].append(self.abspath(path))
+
+        return result
+
+
+
+def file_sequence(name):
+    """
+    Returns (day, sequence number) from post file name YYYYMMDD-p##-slug.md,
+    or (None, None) if name is not numbered.
+    """
+    m = _sequenced.match(name)
+    if m is None:
+        return None, None
+
+    return m.group(1), int(m.group(2))
+
+
+
+def load_post(state, fname, fingerprint, settings):
+    """
+    Returns a post restored from its state in the index.
+    """
+    post = Post.__new__(Post)
+    post.__dict__.update(pickle.loads(str(state)))
+    post.s = settings
+    post.fname = fname
+    post.source_fingerprint = fingerprint
+
+    return post
+
+
+def text(value):
+    """
+    Returns utf-8 value from the database as yaml returns strings: str if
+    ascii, else unicode.
+    """
+    value = value.decode('utf-8')
+    try:
+        return value.encode('ascii')
+    except UnicodeEncodeError:
+        return value
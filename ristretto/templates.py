@@ -0,0 +1,151 @@
+# coding: utf-8
+
+
+import os
+
+from jinja2 import meta, nodes
+
+import tools
+
+
+class TemplateDependencies(object):
+    """
+    Graph of the templates each template uses through extends, include and
+    import, so outputs only depend on the templates they are rendered
+    with.
+
+    Templates referenced by a dynamic name (i.e., {% include var %}) could
+    be any template: a template using them depends on all templates.
+
+    Also finds the assets templates use, through asset_url() calls.
+    """
+
+    def __init__(self, env, templates_dir, *args, **kwargs):
+
+        self.env = env
+        self.templates_dir = templates_dir
+
+        self.references = {}    # template -> (file fingerprint, referenced templates, assets)
+        self.fingerprints = {}  # template -> fingerprint, for the current build
+
+
+    def reset(self):
+        """
+        Forgets fingerprints, so changes to template files are detected.
+        """
+        self.fingerprints = {}
+
+
+    def fingerprint(self, name):
+        """
+        Returns a fingerprint of template name and the templates it uses.
+        """
+        if name not in self.fingerprints:
+            self.fingerprints[name] = tools.fingerprint(sorted(
+                (t, self.file_fingerprint(t)) for t in self.closure(name)))
+
+        return self.fingerprints[name]
+
+
+    def closure(self, name):
+        """
+        Returns the set of templates rendering name uses, including name.
+        """
+        result = set()
+        pending = [name]
+
+        while pending:
+            t = pending.pop()
+            if t in result:
+                continue
+            result.add(t)
+
+            referenced = self.parsed(t)[1]
+            if referenced is None:
+                return set(self.all_templates())
+            pending.extend(referenced)
+
+        return result
+
+
+    def assets(self, name):
+        """
+        Returns the set of assets rendering template name uses, or None if
+        some are named by a variable (i.e., asset_url(path)).
+        """
+        result = set()
+
+        for t in self.closure(name):
+            assets = self.parsed(t)[2]
+            if assets is None:
+                return None
+            result.update(assets)
+
+        return result
+
+
+    def parsed(self, name):
+        """
+        Returns (file fingerprint, templates referenced, assets used) for
+        template name.  Templates (or assets) are None if some are named by
+        a variable.
+        """
+        fingerprint = self.file_fingerprint(name)
+
+        cached = self.references.get(name)
+        if cached is None or cached[0] != fingerprint:
+            if fingerprint is None:
+                referenced, assets = [], []
+            else:
+                source = self.env.loader.get_source(self.env, name)[0]
+                ast = self.env.parse(source)
+
+                referenced = list(meta.find_referenced_templates(ast))
+                if None in referenced:
+                    referenced = None
+
+                assets = list(find_assets(ast))
+                if None in assets:
+                    assets = None
+
+            cached = (fingerprint, referenced, assets)
+            self.references[name] = cached
+
+        return cached
+
+
+    def file_fingerprint(self, name):
+        """
+        Returns fingerprint of template name's file, or None if it does not
+        exist.
+        """
+        try:
+            return tools.file_fingerprint(os.path.join(self.templates_dir, *name.split('/')))
+        except OSError:
+            return None
+
+
+    def all_templates(self):
+
+        result = []
+
+        for root, dirs, files in os.walk(self.templates_dir):
+            for f in files:
+                fname = os.path.relpath(os.path.join(root, f), self.templates_dir)
+                result.append(fname.replace(os.sep, '/'))
+
+        return result
+
+
+
+def find_assets(ast):
+    """
+    Yields the names of the assets used by asset_url() calls in template
+    ast, or None for names that are not constants.
+    """
+    for call in ast.find_all(nodes.Call):
+        if isinstance(call.node, nodes.Name) and call.node.name == 'asset_url':
+            if call.args and isinstance(call.args[0], nodes.Const):
+                yield call.args[0].value
+            else:
+                yield None
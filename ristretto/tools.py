@@ -3,8 +3,37 @@
 
 import os
 import logging
+import hashlib
 
 def mkdirp(d):
 	if not os.path.isdir(d):
 		logging.info("Creating directory %s." % d)
-		os.makedirs(d)
\ No newline at end of file
+		os.makedirs(d)
+
+def file_fingerprint(fname):
+	"""
+	Returns a string that changes whenever file fname is modified.
+	"""
+	st = os.stat(fname)
+	return stat_fingerprint(st.st_mtime, st.st_size)
+
+def stat_fingerprint(mtime, size):
+	return "%r:%d" % (mtime, size)
+
+
+def fingerprint(data):
+	"""
+	Returns a short hash of repr(data).
+	"""
+	return hashlib.sha1(repr(data)).hexdigest()
+
+def file_hash(fname):
+	"""
+	Returns the sha1 hex digest of file fname's content.
+	"""
+	h = hashlib.sha1()
+	with open(fname, 'rb') as f:
+		for chunk in iter(lambda: f.read(65536), b''):
+			h.update(chunk)
+
+	return h.hexdigest()
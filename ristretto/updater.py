@@ -11,72 +11,827 @@
 # /cache
 
 import os
-import glob
 import shutil
-import codecs
 import logging
 import re
+import hashlib
+import time
 import datetime
-from operator import itemgetter
+import contextlib
+import multiprocessing
+from cStringIO import StringIO
 
 import markdown
+import pygments
 from smartypants import smartyPants as smartypants
-import PyRSS2Gen
 
-from jinja2 import Environment, FileSystemLoader
-
-from post import NotAPostException, PostIsDraftException, Post
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+
+from post import NotAPostException, PostIsDraftException, Post, RenderedPost
+from corpus import Corpus
+from navigation import Navigation
+from manifest import BuildManifest
+from render_cache import RenderCache
+from writer import OutputWriter
+from paginator import Paginator
+from watcher import create_watcher
+from templates import TemplateDependencies
+from metrics import BuildMetrics
+from profiler import BuildProfiler
+from assets import AssetManifest, hashed_name
+import feeds
+import compress
+import minify
+import css
+import images
 import tools
 
 import pprint as pp
 
 
+# Updater and outputs being written by a pool of worker processes.  Set 
+# before the pool is created, so forked workers inherit them.
+_pending = None
+
+
+def _init_worker():
+
+    updater, outputs = _pending
+    updater.init_renderers()
+
+    # forget what the parent wrote and counted before forking
+    updater.writer.pop_changes()
+    updater.metrics.pop()
+
+
+def _write_output(i):
+
+    updater, outputs = _pending
+    updater.write_output(outputs[i])
+
+    # report files written and metrics back to the parent process
+    return updater.writer.pop_changes() + (updater.metrics.pop(),)
+
+
 class Updater(object):
 
-    def __init__(self, settings, *args, **kwargs):
+    def __init__(self, settings, jobs=1, metrics_dir=None, profile_dir=None, profile_posts=0,
+                 *args, **kwargs):
 
         self.s = settings
 
+        # Number of processes used for rendering
+        self.jobs = jobs
+
+        # Metrics of the current build, written to metrics_dir if given
+        self.metrics = BuildMetrics()
+        self.metrics_dir = metrics_dir
+
+        # Profiles each build phase, and then the profile_posts slowest 
+        # posts, if profile_dir is given
+        self.profiler = BuildProfiler(profile_dir) if profile_dir else None
+        self.profile_posts = profile_posts
+
         self.base_dir = settings.BASE_DIR
         self.drafts_dir = settings.DRAFTS_DIR
         self.posts_dir = settings.POSTS_DIR
         self.www_dir = settings.WWW_DIR
 
-        # Init Jinja2
+        # Posts and pages parsed for the current build
+        self.corpus = None
+
+        # Sidebar navigation (pages, monthly archives) for the current build
+        self.navigation = None
+
+        # Outputs written by previous builds and their dependencies
+        self.manifest = BuildManifest(self.s.MANIFEST_FILE, self.s.BASE_DIR)
+
+        # Fingerprints of inputs shared by all outputs, for the current build
+        self.fingerprints = None
+
+        # Post -> content converted to html, for the current build
+        self.html = {}
+
+        # Writes output files, only when their content changes
+        self.writer = OutputWriter()
+
+        # Rendered markdown, kept between builds
+        self.render_cache = RenderCache(self.s.RENDER_CACHE_DIR, 
+            self.s.RENDER_CACHE_MAX_SIZE,
+            salt=repr((markdown.version, pygments.__version__, self.s.MD_EXTENSIONS, 
+                self.s.MD_OUTPUT_FORMAT)))
+
+        # Minified html, kept between builds.  Pages are rendered once per
+        # build, so entries are not kept in memory.
+        self.minify_cache = RenderCache(self.s.MINIFY_CACHE_DIR,
+            self.s.RENDER_CACHE_MAX_SIZE,
+            salt=repr(minify.VERSION), memory=False)
+
+        # Whether rendered markdown and minified html are taken from their
+        # caches (not when profiling renders)
+        self.use_caches = True
+
+        # Static and media files, published under content-hashed names
+        self.assets = AssetManifest(self.s.ASSETS_MANIFEST_FILE, self.get_asset_dirs())
+        self.missing_assets = set()
+
+        # Tags, classes and ids used by pages, for pruning stylesheets
+        self.css_usage = css.CssUsage(self.s.CSS_USAGE_FILE, self.s.BASE_DIR)
+
+        # Stylesheet asset name -> (digest, parsed stylesheet)
+        self.stylesheets = {}
+
+        # Sizes of the images in the media dir and the images used by each
+        # post, for responsive images
+        self.images = None
+        if self.s.RESPONSIVE_IMAGES:
+            if images.Image is None:
+                logging.warning("Pillow not available: images are not resized.")
+            else:
+                self.images = images.ImageIndex(self.s.IMAGES_INDEX_FILE, self.s.IMAGES_CACHE_DIR,
+                    self.s.IMAGE_WIDTHS, webp=self.s.IMAGE_WEBP)
+
+        self.init_renderers()
+
+        # Templates used by each template, for outputs dependencies
+        self.templates = TemplateDependencies(self.j2, self.s.TEMPLATES_DIR)
+
+
+    def init_renderers(self):
+        """
+        Creates the Jinja2 environment and markdown converter.  Every worker
+        process creates its own.
+        """
+
+        # Init Jinja2.  Compiled templates are cached on disk, so they are 
+        # only compiled again when they change.
+        tools.mkdirp(self.s.TEMPLATES_CACHE_DIR)
         self.j2 = Environment(loader=FileSystemLoader(self.s.TEMPLATES_DIR, 
-            encoding=self.s.INPUT_ENCODING))
+            encoding=self.s.INPUT_ENCODING),
+            bytecode_cache=FileSystemBytecodeCache(self.s.TEMPLATES_CACHE_DIR))
+        self.j2.globals['asset_url'] = self.asset_url
+
+        self.md = markdown.Markdown(
+            extensions=self.s.MD_EXTENSIONS,
+            #extension_configs=self.s.MD_EXTENSION_CONFIGS,
+            output_format=self.s.MD_OUTPUT_FORMAT,
+        )
 
 
     def update(self, force_publish=False):
+        """
+        Builds the blog.  Only outputs whose inputs changed since the last
+        build are rendered, unless force_publish is True.
+        """
 
-        self.publish_drafts_previews()
-        self.publish_pages(force_publish=True)
-        self.publish_404(force_publish=True)
-        self.publish_500(force_publish=True)
-        self.publish_monthly_archive(force_publish=True)
-        self.publish_index_pages()
-        self.publish_rss()
+        self.metrics = BuildMetrics()
+        if self.profiler is not None:
+            self.profiler.reset()
+
+        written = len(self.writer.changed)
+
+        with self.phase('drafts'):
+            self.publish_drafts_previews()
+
+        # drafts may have been moved to posts dir: (re)load corpus afterwards
+        with self.phase('load'):
+            self.load_corpus()
+
+        with self.phase('assets'):
+            self.publish_assets()
+            if self.s.PRUNE_CSS:
+                # templates link pruned stylesheets instead of PRUNE_CSS assets
+                self.assets.overrides = self.pruned_urls()
+
+        if self.images is not None:
+            with self.phase('images'):
+                self.publish_images()
+
+        with self.phase('pages'):
+            self.publish_pages(force_publish=force_publish)
+            self.publish_404(force_publish=force_publish)
+            self.publish_500(force_publish=force_publish)
+        with self.phase('archive'):
+            self.publish_monthly_archive(force_publish=force_publish)
+        with self.phase('index'):
+            self.publish_index_pages(force_publish=force_publish)
+        with self.phase('feeds'):
+            self.publish_rss(force_publish=force_publish)
+        with self.phase('permalinks'):
+            self.publish_permalinks(force_publish=force_publish)
+        with self.phase('tags'):
+            self.publish_tags(force_publish=force_publish)
+
+        if self.s.PRUNE_CSS:
+            with self.phase('css'):
+                self.prune_css([f for f, size in self.writer.changed[written:]])
+
+        if self.s.GZIP_OUTPUTS:
+            with self.phase('compress'):
+                self.compress_outputs([f for f, size in self.writer.changed[written:]])
+
+        with self.phase('cleanup'):
+            self.manifest.collect_garbage(sidecars=(compress.SIDECAR_EXT,))
+            self.manifest.save()
+
+            self.render_cache.prune()
+            if self.images is not None:
+                self.images.save()
+            if self.s.MINIFY_HTML:
+                self.minify_cache.prune()
+        logging.info("Render cache: %d hits, %d misses." % (self.render_cache.hits, self.render_cache.misses))
+
+        if self.profiler is not None and self.profile_posts:
+            self.profile_slowest_posts(self.profile_posts)
+
+        if self.metrics_dir:
+            self.metrics.write(self.metrics_dir)
+
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Measures a build phase (see BuildMetrics.phase), counting the
+        files it writes, and profiles it if profiling.
+        """
+        written = len(self.writer.changed)
+
+        with self.metrics.phase(name):
+            if self.profiler is None:
+                yield
+            else:
+                with self.profiler.phase(name):
+                    yield
+            changed = self.writer.changed[written:]
+            self.metrics.count('files_written', len(changed))
+            self.metrics.count('bytes_written', sum(size for fname, size in changed))
 
 
-        # Check posts that need publishing or republishing
-        np = self.need_publishing(self.posts_dir)
+    def get_asset_dirs(self):
+        """
+        Returns (directory, url) of static and media files.  Blogs that keep
+        them in WWW_DIR, with no STATIC_DIR or MEDIA_DIR, get their hashed
+        copies next to them.
+        """
+        result = []
 
-        if np:
-            self.publish_permalinks(posts=[Post(p, self.s) for p in np])
-            self.publish_tags(posts=[Post(p, self.s) for p in np])
+        for dname, url in ((self.s.STATIC_DIR, self.s.WWW_STATIC_URL), (self.s.MEDIA_DIR, self.s.WWW_MEDIA_URL)):
+            if not os.path.isdir(dname):
+                dname = os.path.join(self.www_dir, url)
+            result.append((dname, '/' + url))
+
+        return result
+
+
+    def publish_assets(self):
+        """
+        Copies static and media files that changed to their content-hashed
+        names (see AssetManifest).  Copies are build outputs: old ones are
+        removed with the garbage.  Returns the number of copies whose
+        record in the build manifest changed.
+        """
+        # copies written next to their files are not assets
+        ignore = set(os.path.join(self.base_dir, key) for key in self.manifest.outputs)
+
+        # image variants are outputs too, also when not enabled anymore
+        hashed = self.assets.refresh(ignore, skip=images.is_variant)
+        self.metrics.count('assets_hashed', hashed)
+        changed = 0
+
+        for name, asset in sorted(self.assets.assets.items()):
+            fname = os.path.join(self.www_dir, *asset['url'].lstrip('/').split('/'))
+            deps = {'source': asset['digest']}
+
+            if not self.manifest.is_fresh(fname, deps):
+                if self.writer.copy(fname, asset['source']):
+                    logging.info("Wrote asset %s." % fname)
+                changed += 1
+
+            self.manifest.record(fname, deps)
+
+        return changed
+
+
+    def get_media_url(self):
+
+        return '/' + self.s.WWW_MEDIA_URL
+
+
+    def publish_images(self):
+        """
+        Publishes resized variants of the images in the media dir that 
+        posts reference next to them, for the srcset of <img> tags in posts
+        (see post_html()).  Variants are made by a pool of processes, and 
+        cached by image digest and width, so only new images are resized.
+        """
+        # images are named by their path in the media dir
+        prefix = self.s.WWW_MEDIA_URL.strip('/') + '/'
+        found = [(name[len(prefix):], asset['source'], asset['digest']) 
+            for name, asset in sorted(self.assets.assets.items())
+            if name.startswith(prefix) and os.path.splitext(name)[1].lower() in images.IMAGE_EXTENSIONS]
+
+        self.images.refresh(found)
+
+        corpus = self.get_corpus()
+        posts = corpus.posts + corpus.pages
+        self.images.forget_posts([self.manifest.relpath(p.fname) for p in posts])
+        for post in posts:
+            self.image_references(post)
+
+        sources = dict((name, source) for name, source, digest in found)
+        tasks = []
+        variants = []
+
+        for name in sorted(self.images.referenced()):
+            for width, ext, cached in self.images.variants(name):
+                if not os.path.exists(cached):
+                    tasks.append((sources[name], cached, width))
+
+                fname = os.path.join(self.www_dir, self.s.WWW_MEDIA_URL, 
+                    *images.variant_name(name, width, ext).split('/'))
+                variants.append((fname, cached))
+
+        if tasks:
+            logging.info("Resizing %d images." % len(tasks))
+        images.resize_all(tasks)
+        self.metrics.count('images_resized', len(tasks))
+
+        for fname, cached in variants:
+            deps = {'source': os.path.basename(cached)}
+
+            if not self.manifest.is_fresh(fname, deps):
+                self.writer.copy(fname, cached)
+
+            self.manifest.record(fname, deps)
+
+        self.images.prune_cache()
+
+
+    def image_references(self, post):
+        """
+        Returns the names of the images post references.
+        """
+        return self.images.references(self.manifest.relpath(post.fname), 
+            self.get_corpus().fingerprint(post.fname), lambda: post.content, self.get_media_url())
+
+
+    def asset_url(self, name):
+        """
+        Returns the url of the content-hashed copy of asset name (i.e., 
+        'css/style.css'), for templates.
+        """
+        url = self.assets.url(name)
+
+        if url is None:
+            if name not in self.missing_assets:
+                logging.warning("Unknown asset %s." % name)
+                self.missing_assets.add(name)
+            url = '/%s/%s' % (self.s.WWW_STATIC_URL, name.lstrip('/'))
+
+        return url
+
+
+    def get_stylesheet(self, name):
+        """
+        Returns the parsed stylesheet of asset name, or None if there is no
+        such asset.
+        """
+        asset = self.assets.get(name)
+        if asset is None:
+            return None
+
+        cached = self.stylesheets.get(name)
+        if cached is None or cached[0] != asset['digest']:
+            with open(asset['source'], 'rb') as f:
+                cached = (asset['digest'], css.Stylesheet(f.read()))
+            self.stylesheets[name] = cached
+
+        return cached[1]
+
+
+    def pruned_urls(self):
+        """
+        Returns a dict asset name -> url of the pruned copy of each PRUNE_CSS
+        stylesheet.  Urls are named after the digest of the stylesheet, not
+        of the pruned copy, so pages do not change when the rules used by
+        the site do; only the pruned copies are written again.
+        """
+        result = {}
+
+        for name in self.s.PRUNE_CSS:
+            asset = self.assets.get(name)
+            if asset is not None:
+                base, ext = os.path.splitext(self.assets.key(name))
+                result[self.assets.key(name)] = '/%s' % hashed_name(base + '.pruned' + ext, asset['digest'])
+
+        return result
+
+
+    def prune_css(self, written):
+        """
+        Writes the stylesheets in PRUNE_CSS with only the rules that apply to
+        the tags, classes and ids used by the pages (and PRUNE_CSS_KEEP, for
+        those only added by scripts), at their pruned_urls().  Only pages 
+        written by this build are scanned again.  Must be called after all 
+        pages are published.
+
+        Args:
+            written
+                file names of the files written by this build.
+        """
+        pages = [os.path.join(self.base_dir, key) for key in self.manifest.produced
+            if key.endswith(self.s.HTML_EXT)]
+
+        used = self.css_usage.update(sorted(pages), set(written)) | set(self.s.PRUNE_CSS_KEEP)
+        urls = self.pruned_urls()
+
+        for name in self.s.PRUNE_CSS:
+            stylesheet = self.get_stylesheet(name)
+            if stylesheet is None:
+                logging.warning("Unknown stylesheet %s." % name)
+                continue
+
+            text = stylesheet.write(used)
+
+            url = urls[self.assets.key(name)]
+            fname = os.path.join(self.www_dir, *url.lstrip('/').split('/'))
+
+            if self.writer.write(fname, text):
+                logging.info("Wrote pruned stylesheet %s (%d of %d bytes)." % (fname, 
+                    len(text), os.path.getsize(self.assets.get(name)['source'])))
+            self.manifest.record(fname, {'source': hashlib.sha1(text).hexdigest()})
+
+        self.css_usage.save()
+
+
+    def inline_critical_css(self, html):
+        """
+        Returns html with the rules of PRUNE_CSS stylesheets that apply to
+        its elements above the fold inlined in its head, and those 
+        stylesheets loaded without blocking rendering, so pages can be 
+        shown before stylesheets are loaded.  Pages with more than 
+        css.CRITICAL_CSS_MAX bytes of critical css are not changed.
+        """
+        head = html.find('</head>')
+        if head == -1:
+            return html
+
+        used = css.tokens(css.above_the_fold(html))
+        rules = []
+
+        for name in self.s.PRUNE_CSS:
+            stylesheet = self.get_stylesheet(name)
+            if stylesheet is not None:
+                rules.append(stylesheet.write(used))
+
+        rules = '\n'.join(rules)
+        if len(rules) > css.CRITICAL_CSS_MAX:
+            logging.debug("Not inlining %d bytes of critical css." % len(rules))
+            return html
+
+        urls = set(self.assets.url(name) for name in self.s.PRUNE_CSS)
+        html = css.defer_stylesheets(html, urls)
+        head = html.find('</head>')
+
+        return u'%s<style>\n%s\n</style>\n%s' % (html[:head], rules.decode('utf-8'), html[head:])
+
+
+    def compress_outputs(self, written):
+        """
+        Writes gzip compressed copies (.gz) of the html, xml and json outputs
+        written by this build (or missing their copy), and of the files in 
+        the static dir that changed, for web servers that serve them 
+        precompressed.  Must be called after all outputs are published.
+
+        Args:
+            written
+                file names of the files written by this build.
+        """
+        written = set(written)
+        fnames = []
+
+        for key in self.manifest.produced:
+            fname = os.path.join(self.base_dir, key)
+
+            if os.path.splitext(fname)[1] in compress.GZIP_EXTENSIONS and (
+                    fname in written or not os.path.exists(compress.sidecar(fname))):
+                fnames.append(fname)
+
+        # compressed static files are build outputs, so they are removed
+        # with their file
+        static = []
+        for fname in compress.static_files(os.path.join(self.www_dir, self.s.WWW_STATIC_URL)):
+            deps = {'source': tools.file_fingerprint(fname)}
+            if not self.manifest.is_fresh(compress.sidecar(fname), deps):
+                fnames.append(fname)
+            static.append((compress.sidecar(fname), deps))
+
+        compress.gzip_files(sorted(fnames))
+
+        for fname, deps in static:
+            self.manifest.record(fname, deps)
+
+        self.metrics.count('files_compressed', len(fnames))
+        logging.info("Compressed %d files." % len(fnames))
+
+
+    def profile_slowest_posts(self, n):
+        """
+        Renders again the n slowest posts of the build as the build does
+        (see post_html()), but without the render and minify caches, 
+        profiled as phase 'posts'.  Nothing is written, and the build's
+        metrics are left as they are.
+        """
+        corpus = self.get_corpus()
+
+        # draft previews are rendered too, but are not in the corpus
+        fnames = [os.path.join(self.base_dir, fname) for fname, seconds in self.metrics.slowest()]
+        slowest = [corpus.get(fname) for fname in fnames if fname in corpus.by_fname][:n]
+
+        logging.info("Profiling posts: %s" % ", ".join(p.fname for p in slowest))
+
+        metrics = self.metrics
+        self.metrics = BuildMetrics()
+        self.use_caches = False
+
+        try:
+            with self.profiler.phase('posts'):
+                for post in slowest:
+                    if post in corpus.pages:
+                        output = self.plan_pages([post])[0]
+                    else:
+                        output = self.plan_permalinks([post])[0]
+
+                    self.html.pop(post, None)
+                    self.render_output(output)
+        finally:
+            self.metrics = metrics
+            self.use_caches = True
+
+
+    def watch(self, force_publish=False, on_build=None):
+        """
+        Rebuilds the blog each time drafts, posts, pages or templates change,
+        until interrupted.  Parsed posts, rendered markdown and compiled 
+        templates are kept in memory between builds.
+
+        Args:
+            on_build
+                if given, called with no arguments after each successful build.
+        """
+        watcher = create_watcher(
+            [self.s.DRAFTS_DIR, self.s.POSTS_DIR, self.s.PAGES_DIR, self.s.TEMPLATES_DIR],
+            ignore=[self.s.DRAFTS_PREVIEW_DIR]
+        )
+
+        while True:
+            changed = watcher.wait()
+            logging.info("Changed files: %s" % ", ".join(changed))
+
+            start = time.time()
+            try:
+                self.update(force_publish=force_publish)
+            except Exception as e:
+                logging.exception("Build failed.")
+                print("Build failed: {0}".format(e))
+            else:
+                print("Rebuilt in {0:.3f}s after changes to {1} file(s).".format(time.time() - start, len(changed)))
+                if on_build is not None:
+                    on_build()
+
+
+    def load_corpus(self):
+        """
+        Loads the corpus, or refreshes it if already loaded, and the data
+        derived from it.
+        """
+        if self.corpus is None:
+            self.get_corpus()
         else:
-            self.publish_permalinks(force_publish=True)
-            self.publish_tags(force_publish=True)
+            self.corpus.load()
+            self.metrics.count('sources_parsed', self.corpus.parsed)
 
+        self.update_navigation()
+        self.fingerprints = None
+        self.templates.reset()
+        self.html = {}
 
-    def prepare_post(self, post):
 
-        post.title = smartypants(post.title)
-        post.content = smartypants(markdown.markdown(post.content, 
-            extensions=self.s.MD_EXTENSIONS,
-            extension_configs=self.s.MD_EXTENSION_CONFIGS,
-            output_format=self.s.MD_OUTPUT_FORMAT
-        ))
+    def get_corpus(self):
+        """
+        Returns the corpus, loading it on first use (i.e., by draft previews,
+        before the 'load' phase).
+        """
+        if self.corpus is None:
+            self.corpus = Corpus(self.s)
+            self.metrics.count('sources_parsed', self.corpus.parsed)
+
+        return self.corpus
+
+
+    def get_navigation(self):
+
+        if self.navigation is None:
+            self.update_navigation()
+
+        return self.navigation
+
+
+    def update_navigation(self):
+        """
+        Recomputes site navigation, only if pages or months changed.
+        """
+        corpus = self.get_corpus()
+
+        if self.navigation is None or self.navigation.key != Navigation.key_for(corpus):
+            self.navigation = Navigation(self.s, corpus)
+
+
+    def get_fingerprints(self):
+        """
+        Returns fingerprints of the inputs every output depends on.
+        """
+        if self.fingerprints is None:
+
+            settings = [(k, getattr(self.s, k)) for k in sorted(dir(self.s)) if k.isupper()]
+
+            self.fingerprints = {
+                'settings': tools.fingerprint(settings),
+                'navigation': tools.fingerprint(self.get_navigation().key),
+            }
+
+        return self.fingerprints
+
+
+    def output_deps(self, output):
+        """
+        Returns the dependencies of output: a dict with a fingerprint for 
+        each input it is rendered from.
+        """
+        deps = dict(self.get_fingerprints())
+
+        if output.template is None:
+            # feeds do not use templates or navigation
+            del deps['navigation']
+        else:
+            deps['templates'] = self.templates.fingerprint(output.template)
+
+            assets = self.templates.assets(output.template)
+            if assets is None or assets:
+                deps['assets'] = self.assets.fingerprint(assets)
+
+            if self.s.INLINE_CRITICAL_CSS and self.s.PRUNE_CSS:
+                # pruned urls are named after the stylesheets' digests
+                deps['css'] = tools.fingerprint([(name, self.assets.url(name)) for name in self.s.PRUNE_CSS])
+
+        corpus = self.get_corpus()
+        for post in output.sources():
+            deps['source:%s' % self.manifest.relpath(post.fname)] = corpus.fingerprint(post.fname)
+
+        if self.images is not None:
+            used = set()
+            for post in output.sources():
+                used.update(self.image_references(post))
+            if used:
+                deps['images'] = self.images.fingerprint(used)
+
+        if output.context:
+            deps['context'] = tools.fingerprint(sorted(output.context.items()))
+
+        return deps
+
+
+    def publish(self, outputs, force_publish=False):
+        """
+        Writes outputs that are not up to date.
+        """
+        stale = []
+        deps = [self.output_deps(output) for output in outputs]
+
+        for output, d in zip(outputs, deps):
+            if force_publish or not self.manifest.is_fresh(output.fname, d):
+                stale.append(output)
+
+        if self.jobs > 1 and len(stale) > 1:
+            self.write_outputs_in_parallel(stale)
+        else:
+            for output in stale:
+                self.write_output(output)
+
+        for output, d in zip(outputs, deps):
+            self.manifest.record(output.fname, d)
+
+        logging.info("%d of %d files were up to date." % (len(outputs) - len(stale), len(outputs)))
+
+
+    def write_outputs_in_parallel(self, outputs):
+        """
+        Writes outputs using a pool of self.jobs processes.  Each output is 
+        rendered from its own inputs only, so results do not depend on the
+        order in which workers pick them.
+        """
+        global _pending
+
+        _pending = (self, outputs)
+        pool = multiprocessing.Pool(self.jobs, initializer=_init_worker)
+
+        try:
+            chunksize = max(1, len(outputs) // (self.jobs * 4))
+            for changed, unchanged, metrics in pool.imap_unordered(_write_output, range(len(outputs)), chunksize):
+                self.writer.record_changes(changed, unchanged)
+                self.metrics.merge(metrics)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            _pending = None
+
+
+    def write_output(self, output):
+
+        if output.post is not None:
+            fname = self.manifest.relpath(output.post.fname)
+            converted = self.metrics.render_time(fname)
+        start = time.time()
+
+        # TODO: check dir owner/permission
+        if output.kind == Output.FEED:
+            # feeds are streamed to the file, one item at a time
+            f = self.writer.open(output.fname)
+            try:
+                self.write_feed(output, f)
+            except:
+                f.discard()
+                raise
+            changed = f.commit()
+        else:
+            changed = self.writer.write(output.fname, self.render_output(output))
+
+        if output.post is not None:
+            # not counting the markdown conversion, already recorded by post_html()
+            converting = self.metrics.render_time(fname) - converted
+            self.metrics.record_render(fname, time.time() - start - converting)
+
+        if changed:
+            logging.info("Wrote %s." % output.fname)
+
+
+    def render_output(self, output):
+        """
+        Returns the content of output, encoded.
+        """
+        if output.kind == Output.FEED:
+            f = StringIO()
+            self.write_feed(output, f)
+            return f.getvalue()
+
+        if output.kind == Output.POSTS:
+            html = self.render_posts(
+                posts=[self.prepared(p) for p in output.posts],
+                template=output.template,
+                **output.context
+            )
+        else:
+            post = self.prepared(output.post) if output.post else None
+            html = self.render_single_post(post=post, template=output.template)
+
+        return html.encode(self.s.OUTPUT_ENCODING)
+
+
+    def plan_all(self):
+        """
+        Returns all outputs of a full build, except drafts previews.
+        """
+        return (self.plan_pages() + self.plan_404() + self.plan_500() +
+            self.plan_monthly_archive() + self.plan_index_pages() + self.plan_feeds() + 
+            self.plan_permalinks() + self.plan_tags())
+
+
+    def post_html(self, post):
+        """
+        Returns post content converted to html.  Converted once per build.
+        """
+        if post not in self.html:
+            start = time.time()
+            html = smartypants(self.md_to_html(post.content))
+            if self.images is not None:
+                html = self.images.rewrite(html, self.get_media_url())
+            self.html[post] = html
+            self.metrics.record_render(self.manifest.relpath(post.fname), time.time() - start)
+
+        return self.html[post]
+
+
+    def prepared(self, post):
+        """
+        Returns post for rendering templates, with title and content 
+        converted to html.  Posts from the corpus are shared between 
+        publishers, so they are never modified in place.  Content is 
+        converted on first use, once per build (see post_html()).
+        """
+        return RenderedPost(post, smartypants(post.title), self.post_html)
 
 
     def publish_drafts_previews(self):
@@ -111,17 +866,7 @@ class Updater(object):
                 if post.status and (post.status.upper() == self.s.POST_STATUS_PUBLISH.upper()):
 
                     post.normalize()
-                    self.prepare_post(post)
-
-                    template = self.j2.get_template(self.s.PERMALINK_TEMPLATE)
-                    html = template.render(
-                        blog_title=self.s.BLOG_TITLE,
-                        blog_url=self.s.BLOG_URL,
-                        blog_description=self.s.BLOG_DESCRIPTION,
-                        post=post, 
-                        prev_page_url=None,
-                        next_page_url=None,
-                    )
+                    html = self.render_draft_preview(post)
 
                     fname = "%s%s" % (os.path.splitext(os.path.split(f)[1])[0], self.s.HTML_EXT)
 
@@ -129,6 +874,26 @@ class Updater(object):
                     logging.info("Wrote preview post to %s" % fname)
 
 
+    def render_draft_preview(self, post):
+
+        post = self.prepared(post)
+
+        template = self.j2.get_template(self.s.PERMALINK_TEMPLATE)
+        self.metrics.count('template_renders')
+        html = template.render(
+            blog_title=self.s.BLOG_TITLE,
+            blog_url=self.s.BLOG_URL,
+            blog_description=self.s.BLOG_DESCRIPTION,
+            post=post, 
+            prev_page_url=None,
+            next_page_url=None,
+            pages=self.get_navigation().pages,
+            archive=self.get_navigation().archive,
+        )
+
+        return self.finish_html(html)
+
+
     def is_in_future(self, post):
         """
         Compares post date with today's date (down to hours, minutes and seconds,
@@ -222,55 +987,38 @@ class Updater(object):
 
 
     def write_html(self, dname, fname, html):
-
-        tools.mkdirp(dname)
-
-        # write post
-        outf = codecs.open(os.path.join(dname, fname), "w", encoding=self.s.OUTPUT_ENCODING)
-        outf.write(html)
-        outf.close()
+        """
+        Writes html to file fname in directory dname, if it changed.  
+        Returns True if the file was written.
+        """
+        return self.writer.write(os.path.join(dname, fname), html.encode(self.s.OUTPUT_ENCODING))
 
 
 
     def publish_pages(self, posts=None, force_publish=False):
-        
-        if force_publish:
-            posts = [Post(os.path.join(self.s.PAGES_DIR, f), self.s) for f in os.listdir(self.s.PAGES_DIR) if f.endswith(self.s.MD_EXT)]
-
-        for post in posts:
 
-            post.content = smartypants(self.md_to_html(post.content))
-            post.title = smartypants(post.title)
+        self.publish(self.plan_pages(posts), force_publish)
 
-            html_fname = "%s%s" % (post.slug, self.s.HTML_EXT)
-            html_dir = os.path.join(self.s.WWW_DIR, self.s.WWW_PAGES_URL)
-            html_full_path = os.path.join(html_dir, html_fname)
 
-            tools.mkdirp(html_dir)
-            # TODO: check dir owner/permission
-            self.write_single_post_to_file(post=post, fname=html_full_path, template=self.s.PAGES_TEMPLATE)
+    def plan_pages(self, posts=None):
 
+        if posts is None:
+            posts = self.get_corpus().pages
 
+        html_dir = os.path.join(self.s.WWW_DIR, self.s.WWW_PAGES_URL)
 
-    def get_next_sequence(self, year, month, day):
-
-        seq = []
-        s = "%04d%02d%02d-*%s"  % (year, month, day, self.s.MD_EXT)
-
+        return [Output(Output.POST, 
+                    fname=os.path.join(html_dir, "%s%s" % (post.slug, self.s.HTML_EXT)),
+                    template=self.s.PAGES_TEMPLATE,
+                    post=post) 
+                for post in posts]
 
-        for f in glob.glob(os.path.join(self.s.POSTS_DIR, 
-                "%04d" % int(year), "%02d" % int(month), s)):
-            # get all sequence numbers for date
-            head, tail = os.path.split(f)
-            seq.append(int(tail[10:12]))
 
-        if seq:
-            seq.sort()
-            result = seq[-1] + 1
-        else:
-            result = 1
+    def get_next_sequence(self, year, month, day):
 
-        return result
+        return self.get_corpus().next_sequence(
+            os.path.join(self.s.POSTS_DIR, "%04d" % int(year), "%02d" % int(month)),
+            "%04d%02d%02d" % (year, month, day))
 
 
     def get_all_posts_paths(self, posts_dir):
@@ -288,68 +1036,17 @@ class Updater(object):
         return result
         
     
-    def need_publishing(self, posts_dir):
-        """
-        Returns a list of files that need republishing.
-        """
-
-        result = []
-
-        for root, dirs, files in os.walk(posts_dir):
-            # print "root: %s dirs: %s files: %s" % (root, dirs, files)
-            if files:
-                for f in files:
-                    if os.path.splitext(f)[1] == self.s.MD_EXT:
-                        # only process .md files
-                        if self.post_needs_publishing(root, f):
-                            result.append(os.path.join(root, f))
-        return result
-
-
-    def post_needs_publishing(self, posts_dir, fname):
-
-        # Posts needs publishing if:
-        # - html permalink does not exists
-        # - html permalink is older than post .md file
-
-        result = False
-
-        md_full_path = os.path.join(posts_dir, fname)
-        post = Post(md_full_path, self.s)
-        year = post.date.year
-        month = post.date.month
-        day = post.date.day
-
-        html_fname = "%s%s" % (post.slug, self.s.HTML_EXT)
-        html_full_path = os.path.join(self.s.WWW_DIR, "%04d" % int(year), "%02d" % int(month),
-            "%02d" % int(day), html_fname)
-
-        if os.path.exists(html_full_path):
-            dt_md = os.path.getmtime(md_full_path)
-            dt_html = os.path.getmtime(html_full_path)
-
-            if dt_md > dt_html:
-                result = True
-        else:
-            result = True
-
-        return result
-
-
-
-
     def publish_permalinks(self, posts=None, force_publish=False):
 
+        self.publish(self.plan_permalinks(posts), force_publish)
 
-        if force_publish or posts is None:
-            file_posts = self.get_all_file_posts_by_date()
-            
-            posts = [ Post(f, self.s) for f in self.get_all_file_posts_by_date()]
 
-        for post in posts:
-            post.content = smartypants(self.md_to_html(post.content))
-            post.title = smartypants(post.title)
+    def plan_permalinks(self, posts=None):
 
+        if posts is None:
+            posts = self.get_corpus().posts
+
+        result = []
 
         for p in posts:
             html_fname = "%s%s" % (p.slug, self.s.HTML_EXT)
@@ -357,11 +1054,13 @@ class Updater(object):
                 "%04d" % int(p.date.year), 
                 "%02d" % int(p.date.month),
                 "%02d" % int(p.date.day))
-            html_full_path = os.path.join(html_dir, html_fname)
 
-            tools.mkdirp(html_dir)
-            # TODO: check dir owner/permission
-            self.write_single_post_to_file(post=p, fname=html_full_path, template=self.s.PERMALINK_TEMPLATE)
+            result.append(Output(Output.POST,
+                fname=os.path.join(html_dir, html_fname),
+                template=self.s.PERMALINK_TEMPLATE,
+                post=p))
+
+        return result
 
 
     def remove_post_review(self, post):
@@ -374,41 +1073,33 @@ class Updater(object):
 
 
 
-    def write_single_post_to_file(self, post, fname, template):
-
+    def render_single_post(self, post, template):
+        """
+        Args:
+            post
+                prepared post (see prepared()), or None.
+        """
         template = self.j2.get_template(template)
 
-        if post:
-            post.title = smartypants(post.title)
-            post.content = smartypants(self.md_to_html(post.content))
-
+        self.metrics.count('template_renders')
         html = template.render(
             blog_title=self.s.BLOG_TITLE,
             blog_url=self.s.BLOG_URL,
             blog_description=self.s.BLOG_DESCRIPTION,
             post=post,
-            pages=self.get_all_pages_permalinks(),
-            archive=self.get_monthly_archives_permalinks()
+            pages=self.get_navigation().pages,
+            archive=self.get_navigation().archive
         )
 
-        # write post
-        output_file = codecs.open(fname, "w", encoding=self.s.OUTPUT_ENCODING)
-        output_file.write(html)
-        output_file.close()
-
-        logging.info("Wrote post to %s." % fname)
-
-
-    def write_posts_to_file(self, posts, dir, fname, template, 
-                    prev_page_url=None, next_page_url=None, tag=None):
+        return self.finish_html(html)
 
-        tools.mkdirp(dir)
 
-        output_fname = os.path.join(dir, fname)
+    def render_posts(self, posts, template, prev_page_url=None, next_page_url=None, tag=None):
 
         # Render template
         template = self.j2.get_template(template)
         
+        self.metrics.count('template_renders')
         html = template.render(
             blog_title=self.s.BLOG_TITLE,
             blog_url=self.s.BLOG_URL,
@@ -417,105 +1108,103 @@ class Updater(object):
             prev_page_url=prev_page_url,
             next_page_url=next_page_url,
             tag=tag,
-            pages=self.get_all_pages_permalinks(),
-            archive=self.get_monthly_archives_permalinks()
+            pages=self.get_navigation().pages,
+            archive=self.get_navigation().archive
         )
 
-        # write post
-        output_file = codecs.open(output_fname, "w", encoding=self.s.OUTPUT_ENCODING)
-        output_file.write(html)
-        output_file.close()
+        return self.finish_html(html)
 
-        logging.info("Wrote %d posts to %s." % (len(posts), output_fname))
 
+    def finish_html(self, html):
+        """
+        Returns rendered html with critical css inlined and minified, as 
+        configured.
+        """
+        if self.s.INLINE_CRITICAL_CSS and self.s.PRUNE_CSS:
+            html = self.inline_critical_css(html)
 
-    def md_to_html(self, text):
-        
-        html = markdown.markdown(text, 
-                extensions=self.s.MD_EXTENSIONS,
-                #extension_configs=self.s.MD_EXTENSION_CONFIGS,
-                output_format=self.s.MD_OUTPUT_FORMAT,
-            )
+        return self.minified(html)
 
-        return html
 
-    def publish_index_pages(self):
+    def minified(self, html):
+        """
+        Returns rendered html minified, if MINIFY_HTML.  Results are cached,
+        so pages rendered again unchanged are not minified again.
+        """
+        if not self.s.MINIFY_HTML:
+            return html
 
-        file_posts = self.get_all_file_posts_by_date()
-        
-        posts = [ Post(f, self.s) for f in self.get_all_file_posts_by_date()]
+        if not self.use_caches:
+            return self.minify_html(html)
 
-        for post in posts:
-            post.content = smartypants(self.md_to_html(post.content))
-            post.title = smartypants(post.title)
+        return self.minify_cache.get(html, self.minify_html)
 
 
-        first_post = 0
-        last_post = first_post + self.s.POSTS_PER_PAGE
-        page_number = 0
-        dest_fname = self.s.INDEX_PAGE
-        dest_dir = self.s.WWW_DIR
-        prev_page_url = None
-        next_page_url = None
+    def minify_html(self, html):
 
+        self.metrics.count('html_minified')
+        return minify.minify_html(html)
 
-        while first_post < len(posts):
 
-            p = posts[first_post:last_post]
+    def md_to_html(self, text):
 
-            if page_number == 0:
-                local_fname = dest_fname
-            else:
-                local_fname = "%s-%d%s" % (os.path.splitext(dest_fname)[0], page_number, self.s.HTML_EXT )
+        if not self.use_caches:
+            return self.convert_markdown(text)
 
-            # Pagination
-            if len(posts) <= last_post:
-                # No next page
-                next_page_url = None
-            else:
-                next_page_url = "%s-%d%s" % (os.path.splitext(self.s.INDEX_PAGE)[0], page_number + 1, self.s.HTML_EXT)
+        return self.render_cache.get(text, self.convert_markdown)
 
-            if first_post - self.s.POSTS_PER_PAGE < 0:
-                prev_page_url = None
-            else:
-                if page_number == 1:
-                    prev_page_url = self.s.INDEX_PAGE
-                else:
-                    prev_page_url = "%s-%d.html" % (os.path.splitext(self.s.INDEX_PAGE)[0], page_number - 1)
-            
 
-            self.write_posts_to_file(
-                posts=p,
-                fname=local_fname,
-                dir=dest_dir,
-                template=self.s.INDEX_TEMPLATE,
-                prev_page_url=prev_page_url,
-                next_page_url=next_page_url,
-            )
+    def convert_markdown(self, text):
+        
+        self.metrics.count('markdown_renders')
+        html = self.md.convert(text)
+        self.md.reset()
 
-            logging.info("Wrote posts %d-%d to %s." % (first_post, last_post, local_fname))
+        return html
 
-            first_post = last_post
-            last_post = first_post + self.s.POSTS_PER_PAGE
-            page_number = page_number + 1 
+    def publish_index_pages(self, force_publish=False):
 
+        self.publish(self.plan_index_pages(), force_publish)
 
 
+    def plan_index_pages(self):
 
-    def get_all_file_posts_by_date(self):
+        return self.plan_listing(self.get_corpus().posts,
+            dest_dir=self.s.WWW_DIR,
+            page_name=self.s.INDEX_PAGE,
+            template=self.s.INDEX_TEMPLATE)
 
-        tmp = {}
 
-        for root, dirs, files in os.walk(self.s.POSTS_DIR):
-            # print "root: %s dirs: %s files: %s" % (root, dirs, files)
-            if files:
-                for f in files:
-                    if os.path.splitext(f)[1] == self.s.MD_EXT:
-                        tmp[f] = os.path.join(root, f)
+    def plan_listing(self, posts, dest_dir, page_name, template, **context):
+        """
+        Returns an output for each page of a paginated posts listing (front
+        page, tag or month).  Each page only depends on its own posts, so
+        a change only rebuilds the pages it shows up in.
 
-        result = [ tmp[key] for key in reversed(sorted(tmp.iterkeys())) ]
+        Args:
+            posts
+                posts in the listing, newest first.
+            page_name
+                file name of the listing's first page.
+            context
+                other template variables, i.e. tag.
+        """
+        paginator = Paginator(posts, self.s.POSTS_PER_PAGE, page_name,
+            stable=self.s.PAGINATION_STABLE)
 
-        return result
+        return [Output(Output.POSTS,
+                fname=os.path.join(dest_dir, page.fname),
+                template=template,
+                posts=page.posts,
+                prev_page_url=page.prev_page_url,
+                next_page_url=page.next_page_url,
+                **context
+            ) for page in paginator.pages()]
+
+
+    def get_all_file_posts_by_date(self):
+
+        return [p.fname for p in self.get_corpus().posts]
 
 
     def get_all_pages_permalinks(self):
@@ -524,16 +1213,8 @@ class Updater(object):
             'url': page permalink
             'title': page title
         """
-        # links are generated from pages .md files, not from .html rendered files
-        pages = [Post(os.path.join(self.s.PAGES_DIR, f), self.s) for f in os.listdir(self.s.PAGES_DIR) if f.endswith(self.s.MD_EXT)]
+        return self.get_navigation().pages
 
-        result = []
-        for post in pages:
-            page_url = os.path.join('/', self.s.WWW_PAGES_URL, "%s%s" % (post.slug, self.s.HTML_EXT))
-            page_title = smartypants(post.title)
-            result.append({ 'url': page_url, 'title': page_title })
-
-        return result
 
     def get_monthly_archives_permalinks(self):
         """
@@ -544,205 +1225,219 @@ class Updater(object):
         Results in list are ordered by date.
 
         """
-
-        result = []
-
-        for root, dirs, files in os.walk(self.s.POSTS_DIR):
-            if files:
-                contains_MD = False
-                for f in files:
-                    if os.path.splitext(f)[1]==self.s.MD_EXT:
-                        contains_MD = True
-                        break
-                if contains_MD:
-                    # Generate month archive permalink for this month
-                    head, month = os.path.split(root)
-                    month = int(month)
-                    year = int(os.path.split(head)[1])
-
-                    permalink = os.path.join('/', "%04d" % year, "%02d" % month, self.s.ARCHIVE_PAGE)
-                    timestamp = datetime.date(year, month, 1)
-                    result.append({
-                        'url': permalink,
-                        'date': timestamp
-                    })
-
-        result = reversed(sorted(result, key=itemgetter('date')))
-        return result
+        return self.get_navigation().archive
 
 
     def publish_monthly_archive(self, posts=None, force_publish=False):
         """
         Publishes pages with monthly articles.
         """
-        
-        if force_publish:
-            file_posts = self.get_all_file_posts_by_date()
-            
-            posts = [ Post(f, self.s) for f in self.get_all_file_posts_by_date()]
+        self.publish(self.plan_monthly_archive(posts), force_publish)
 
-        for post in posts:
-            post.content = smartypants(self.md_to_html(post.content))
-            post.title = smartypants(post.title)
 
+    def plan_monthly_archive(self, posts=None):
 
+        if posts is None:
+            posts = self.get_corpus().posts
 
-        c_month = None
-        c_year = None
-        batch = []
-        publish = False
+        months = []
+        batches = {}
 
         for post in posts:
+            month = (post.date.year, post.date.month)
+            if month not in batches:
+                months.append(month)
+                batches[month] = []
+            batches[month].append(post)
 
-            if (c_month != post.date.month) or (c_year != post.date.year):
-                if batch:
-
-                    dest_dir = os.path.join(self.s.WWW_DIR, "%04d" % c_year, "%02d" % c_month )
-                    tools.mkdirp(dest_dir)
-                    fname = self.s.ARCHIVE_PAGE
-
-                    self.write_posts_to_file(
-                        posts=batch,
-                        fname=fname,
-                        dir=dest_dir,
-                        template=self.s.ARCHIVE_TEMPLATE,
-                        prev_page_url=None,
-                        next_page_url=None
-                    )
-
-                batch = [ ]
-                c_month = post.date.month
-                c_year = post.date.year
-
-            batch.append(post)
+        result = []
 
-        if batch:
+        for c_year, c_month in months:
 
             dest_dir = os.path.join(self.s.WWW_DIR, "%04d" % c_year, "%02d" % c_month )
-            tools.mkdirp(dest_dir)
-            fname = self.s.ARCHIVE_PAGE
-
-            self.write_posts_to_file(
-                posts=batch,
-                fname=fname,
-                dir=dest_dir,
-                template=self.s.ARCHIVE_TEMPLATE,
-                prev_page_url=None,
-                next_page_url=None
-            )
 
-        # Write archive index page
-        #       self.write_single_post_to_file(
-        #           post=None,
-        #           fname=os.path.join(self.s.WWW_DIR, self.s.ARCHIVE_INDEX_PAGE),
-        #           template=self.s.ARCHIVE_INDEX_TEMPLATE,
-        #       )
-        self.write_posts_to_file(
-            posts=posts,
+            result.extend(self.plan_listing(batches[(c_year, c_month)],
+                dest_dir=dest_dir,
+                page_name=self.s.ARCHIVE_PAGE,
+                template=self.s.ARCHIVE_TEMPLATE))
+
+        # Archive index page
+        result.append(Output(Output.POSTS,
             fname=os.path.join(self.s.WWW_DIR, self.s.ARCHIVE_INDEX_PAGE),
-            dir=self.s.WWW_DIR,
             template=self.s.ARCHIVE_INDEX_TEMPLATE,
+            posts=posts,
             prev_page_url=None,
             next_page_url=None
-        )
+        ))
+
+        return result
 
 
     def publish_tags(self, posts=None, force_publish=False):
 
-        
-        if force_publish:
-            file_posts = self.get_all_file_posts_by_date()
-            
-            posts = [ Post(f, self.s) for f in file_posts]
+        self.publish(self.plan_tags(posts), force_publish)
 
 
-        for post in posts:
-            post.content = smartypants(self.md_to_html(post.content))
-            post.title = smartypants(post.title)
+    def plan_tags(self, posts=None):
+
+        result = []
+
+        for tag, tag_posts in self.get_tagged(posts):
+            result.extend(self.plan_listing(tag_posts,
+                dest_dir=os.path.join(self.s.TAGGED_DIR, tag),
+                page_name=self.s.TAGGED_PAGE,
+                template=self.s.TAGGED_TEMPLATE,
+                tag=tag))
+
+        return result
 
 
-        tagged = {} 
+    def get_tagged(self, posts=None):
+        """
+        Returns a list of (tag, posts with tag, newest first), sorted by 
+        tag.  If posts is None, all posts.
+        """
+        if posts is None:
+            return self.get_corpus().tagged()
+
+        tagged = {}
 
         for post in posts:
             for tag in post.tags:
-                if tag not in tagged:
-                    tagged[tag.strip()] = [post ,]
-                else:
-                    tagged[tag.strip()].append(post)
-
+                tagged.setdefault(tag.strip(), []).append(post)
 
-        for tag in tagged.iterkeys():
-            # no pagination yet...
-            dest_dir = os.path.join(self.s.TAGGED_DIR, tag.strip())
-            tools.mkdirp(dest_dir)
+        return sorted(tagged.items())
 
-            self.write_posts_to_file(
-                posts=tagged[tag],
-                fname=self.s.TAGGED_PAGE,
-                dir=dest_dir,
-                template=self.s.TAGGED_TEMPLATE,
-                prev_page_url=None,
-                next_page_url=None,
-                tag=tag
-            )
 
     def publish_404(self, force_publish=False):
-        self.write_single_post_to_file(
-            post=None, 
+
+        self.publish(self.plan_404(), force_publish)
+
+
+    def plan_404(self):
+
+        return [Output(Output.POST,
             fname=os.path.join(self.s.WWW_DIR, self.s.ERR_404_PAGE),
             template=self.s.ERR_404_TEMPLATE
-        )
+        )]
+
 
     def publish_500(self, force_publish=False):
-        self.write_single_post_to_file(
-            post=None, 
+
+        self.publish(self.plan_500(), force_publish)
+
+
+    def plan_500(self):
+
+        return [Output(Output.POST,
             fname=os.path.join(self.s.WWW_DIR, self.s.ERR_500_PAGE),
             template=self.s.ERR_500_TEMPLATE
-        )
+        )]
+
 
 
+    def publish_rss(self, force_publish=False):
+        """
+        Publishes the blog feeds (RSS, Atom and JSON Feed) and feeds for 
+        each tag.
+        """
+        self.publish(self.plan_feeds(), force_publish)
 
-    def publish_rss(self):
 
-        file_posts = self.get_all_file_posts_by_date()
-        posts = [Post(f, self.s) for f in file_posts ]
+    def plan_feeds(self):
+        """
+        Feeds contain the latest FEED_ITEMS posts, so they only need to be
+        rebuilt when those posts change.
+        """
+        posts = self.get_corpus().posts
+
+        result = self.plan_feed(
+            title=self.s.BLOG_TITLE, 
+            link=self.s.BLOG_URL, 
+            description=self.s.BLOG_DESCRIPTION, 
+            dest_dir=self.s.WWW_DIR, 
+            posts=posts[:self.s.FEED_ITEMS]
+        )
 
-        post_items = []
+        if self.s.TAG_FEEDS:
+            for tag, tag_posts in self.get_tagged():
+                result.extend(self.plan_feed(
+                    title="%s: %s" % (self.s.BLOG_TITLE, tag), 
+                    link="%s/%s/%s/" % (self.s.BLOG_URL, self.s.WWW_TAGGED_URL, tag),
+                    description=self.s.BLOG_DESCRIPTION,
+                    dest_dir=os.path.join(self.s.TAGGED_DIR, tag),
+                    posts=tag_posts[:self.s.FEED_ITEMS]
+                ))
 
-        for post in posts:
-            
-            content = re.sub(r'src="/', 
-                'src="%s/' %  self.s.BLOG_URL,
-                self.md_to_html(post.content))
-            content = re.sub(r"src='/",
-                "src='%s/" % self.s.BLOG_URL,
-                content)
-            
-            content =  smartypants(content)
-            
-            post_items.append(FullRSSItem(
-                title=post.title,
-                link=post.permalink,
-                description=content,
-                content=content,
-                guid=PyRSS2Gen.Guid(post.permalink),
-                pubDate=post.date
+        return result
+
+
+    def plan_feed(self, title, link, description, dest_dir, posts):
+        """
+        Returns outputs for a feed in every format.
+        """
+        result = []
+
+        for format, fname in ((feeds.RSS, self.s.RSS_FILE), 
+                              (feeds.ATOM, self.s.ATOM_FILE), 
+                              (feeds.JSON, self.s.JSON_FEED_FILE)):
+
+            feed_url = "%s/%s" % (self.s.BLOG_URL, 
+                os.path.relpath(os.path.join(dest_dir, fname), self.s.WWW_DIR).replace(os.sep, '/'))
+
+            result.append(Output(Output.FEED,
+                fname=os.path.join(dest_dir, fname),
+                posts=posts,
+                format=format,
+                title=title,
+                link=link,
+                description=description,
+                feed_url=feed_url,
+                author=self.s.BLOG_AUTHOR or self.s.BLOG_TITLE
             ))
 
-        rss = PyRSS2Gen.RSS2(
-            title = self.s.BLOG_TITLE,
-            link = self.s.BLOG_URL,
-            description = self.s.BLOG_DESCRIPTION,
-            lastBuildDate = datetime.datetime.utcnow(),
-            items = post_items
+        return result
+
+
+    def write_feed(self, output, out):
+        """
+        Writes feed output to file-like object out.
+        """
+        items = [feeds.FeedItem(
+                    title=post.title,
+                    link=post.permalink,
+                    date=post.date,
+                    content=self.absolute_urls(self.post_html(post))
+                ) for post in output.posts]
+
+        feed = feeds.Feed(
+            title=output.context['title'],
+            link=output.context['link'],
+            description=output.context['description'],
+            feed_url=output.context['feed_url'],
+            items=items,
+            author=output.context['author']
         )
 
-        # add content:encoded namespace
-        rss.rss_attrs['xmlns:content']="http://purl.org/rss/1.0/modules/content/"
+        feeds.write_feed(out, feed, output.context['format'], encoding=self.s.OUTPUT_ENCODING)
+
 
-        dest_fname = os.path.join(self.s.WWW_DIR, self.s.RSS_FILE)
+    def absolute_urls(self, html):
+        """
+        Makes urls of images absolute, for use outside the blog (i.e., feeds).
+        """
+        html = re.sub(r'src="/', 
+            'src="%s/' %  self.s.BLOG_URL,
+            html)
+        html = re.sub(r"src='/",
+            "src='%s/" % self.s.BLOG_URL,
+            html)
+        # urls in srcset="/a.jpg 480w, /b.jpg 960w"
+        html = re.sub(r'(?<=srcset=")[^"]*', 
+            lambda m: re.sub(r'(^|,\s*)/', lambda u: '%s%s/' % (u.group(1), self.s.BLOG_URL), m.group(0)),
+            html)
 
-        rss.write_xml(open(dest_fname, "w"), encoding=self.s.OUTPUT_ENCODING)
+        return html
 
 
     def migrate(self):
@@ -773,37 +1468,36 @@ class Updater(object):
             pd.normalize()
             
 
-class NoOutput:
-    def __init__(self):
-        pass
-    def publish(self, handler):
-        pass
-
-class FullRSSItem(PyRSS2Gen.RSSItem):
-
-    def __init__(self, **kwargs):
-        if 'content' in kwargs:
-            self.content = kwargs['content']
-            del kwargs['content']
-        else:
-            self.content = None
-            
-        PyRSS2Gen.RSSItem.__init__(self, **kwargs)
-        
-    def publish(self, handler):
-        self.do_not_autooutput_description = self.description
-        self.description = NoOutput()
-        PyRSS2Gen.RSSItem.publish(self, handler)
-        
-    def publish_extensions(self, handler):
-        handler._out.write('<%s><![CDATA[%s]]></%s>' % (
-            "description", self.do_not_autooutput_description.encode('utf-8'), "description"
-        ))
-        if self.content:
-            handler._out.write('<%s><![CDATA[%s]]></%s>' % (
-                "content:encoded", self.content.encode('utf-8'), "content:encoded"
-            ))
-# http://stackoverflow.com/questions/5371704/python-generated-rss-outputting-raw-html/7912205#7912205
-
-
-
+class Output(object):
+    """
+    A file written by the build, and what it is rendered from.
+
+    Args:
+        kind
+            POST: single post template, rendered with post (may be None).
+            POSTS: posts list template, rendered with posts.
+            FEED: feed for posts, in context['format'].
+        context
+            other template variables (prev_page_url, next_page_url, tag)
+    """
+
+    POST = 'post'
+    POSTS = 'posts'
+    FEED = 'feed'
+
+    def __init__(self, kind, fname, template=None, post=None, posts=None, **context):
+
+        self.kind = kind
+        self.fname = fname
+        self.template = template
+        self.post = post
+        self.posts = posts
+        self.context = context
+
+    def sources(self):
+        """
+        Returns posts this output is rendered from.
+        """
+        if self.kind == self.POST:
+            return [self.post] if self.post else []
+        return self.posts
@@ -0,0 +1,155 @@
+# coding: utf-8
+
+
+import os
+import time
+import logging
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+
+class PollingWatcher(object):
+    """
+    Detects changes to files under a list of directories by comparing
+    their mtime and size every interval seconds.
+
+    Args:
+        dirs
+            directories to watch, recursively.
+        ignore
+            directories (under dirs) whose changes are ignored.
+    """
+
+    def __init__(self, dirs, ignore=(), interval=1.0, *args, **kwargs):
+
+        self.dirs = dirs
+        self.ignore = [os.path.join(d, '') for d in ignore]
+        self.interval = interval
+
+        self.snapshot = self.take_snapshot()
+
+
+    def is_ignored(self, fname):
+
+        # skip temp and hidden files (editor backups, atomic writes)
+        if os.path.basename(fname).startswith('.'):
+            return True
+
+        return any(fname.startswith(d) for d in self.ignore)
+
+
+    def take_snapshot(self):
+
+        result = {}
+
+        for d in self.dirs:
+            for root, dirs, files in os.walk(d):
+                for f in files:
+                    fname = os.path.join(root, f)
+                    if self.is_ignored(fname):
+                        continue
+                    try:
+                        st = os.stat(fname)
+                    except OSError:
+                        continue
+                    result[fname] = (st.st_mtime, st.st_size)
+
+        return result
+
+
+    def wait(self):
+        """
+        Blocks until files change.  Returns the list of changed files.
+        """
+        while True:
+            time.sleep(self.interval)
+
+            snapshot = self.take_snapshot()
+            changed = [f for f in set(snapshot) | set(self.snapshot)
+                if snapshot.get(f) != self.snapshot.get(f)]
+            self.snapshot = snapshot
+
+            if changed:
+                return sorted(changed)
+
+
+
+class InotifyWatcher(PollingWatcher):
+    """
+    Same as PollingWatcher, using inotify events instead of polling.
+    Requires pyinotify.
+    """
+
+    MASK = 0
+
+    if pyinotify is not None:
+        MASK = (pyinotify.IN_CLOSE_WRITE | pyinotify.IN_CREATE | pyinotify.IN_DELETE |
+            pyinotify.IN_MOVED_FROM | pyinotify.IN_MOVED_TO)
+
+    def __init__(self, dirs, ignore=(), interval=0.2, *args, **kwargs):
+
+        self.dirs = dirs
+        self.ignore = [os.path.join(d, '') for d in ignore]
+
+        # time without events to wait for, so that a batch of changes
+        # (i.e., an editor saving several files) triggers a single rebuild
+        self.interval = interval
+
+        self.changed = set()
+
+        self.wm = pyinotify.WatchManager()
+        self.notifier = pyinotify.Notifier(self.wm, default_proc_fun=self.on_event,
+            timeout=int(interval * 1000))
+        for d in dirs:
+            self.wm.add_watch(d, self.MASK, rec=True, auto_add=True)
+
+
+    def on_event(self, event):
+
+        if not self.is_ignored(event.pathname):
+            self.changed.add(event.pathname)
+
+
+    def read_events(self):
+        """
+        Waits up to interval seconds for events.  Returns True if there 
+        were any.
+        """
+        if self.notifier.check_events():
+            self.notifier.read_events()
+            self.notifier.process_events()
+            return True
+
+        return False
+
+
+    def wait(self):
+
+        while not self.changed:
+            self.read_events()
+
+        # wait until there are no more events
+        while self.read_events():
+            pass
+
+        result = sorted(self.changed)
+        self.changed = set()
+
+        return result
+
+
+def create_watcher(dirs, ignore=()):
+    """
+    Returns an InotifyWatcher if pyinotify is available, else a
+    PollingWatcher.
+    """
+    dirs = [d for d in dirs if os.path.isdir(d)]
+
+    if pyinotify is not None:
+        return InotifyWatcher(dirs, ignore)
+
+    logging.info("pyinotify not available, watching for changes by polling.")
+    return PollingWatcher(dirs, ignore)
@@ -0,0 +1,161 @@
+# coding: utf-8
+
+
+import os
+import shutil
+import hashlib
+import tempfile
+
+import tools
+
+
+# Permissions for new files, as open() would create them
+_umask = os.umask(0)
+os.umask(_umask)
+FILE_MODE = 0o666 & ~_umask
+
+
+class OutputWriter(object):
+    """
+    Writes build outputs.
+
+    Files are only replaced when their content changes, so unchanged outputs
+    keep their mtime, and they are replaced atomically (written to a temp
+    file in the same directory, then renamed) so the web server never sees
+    a half-written file.
+    """
+
+    def __init__(self, *args, **kwargs):
+
+        self.changed = []       # (file name, size) of files written
+        self.unchanged = 0      # files left untouched because content was the same
+
+
+    def write(self, fname, data):
+        """
+        Writes data (a byte string) to fname if its content is different.
+        Returns True if the file was written.
+        """
+        f = self.open(fname)
+        try:
+            f.write(data)
+        except:
+            f.discard()
+            raise
+
+        return f.commit()
+
+
+    def copy(self, fname, source):
+        """
+        Copies file source to fname if their content is different.  Returns
+        True if the file was written.
+        """
+        f = self.open(fname)
+        try:
+            with open(source, 'rb') as src:
+                shutil.copyfileobj(src, f, 65536)
+        except:
+            f.discard()
+            raise
+
+        return f.commit()
+
+
+    def open(self, fname):
+        """
+        Returns a file-like object for writing fname incrementally.  The file
+        is only replaced when the object's commit() method is called; if
+        writing fails, call discard() to remove the temp file.
+        """
+        return AtomicOutputFile(self, fname)
+
+
+    def record_changes(self, changed, unchanged=0):
+
+        self.changed.extend(changed)
+        self.unchanged += unchanged
+
+
+    def pop_changes(self):
+        """
+        Returns and resets the files written and the unchanged count.
+        """
+        result = (self.changed, self.unchanged)
+
+        self.changed = []
+        self.unchanged = 0
+
+        return result
+
+
+    @property
+    def bytes_written(self):
+
+        return sum(size for fname, size in self.changed)
+
+
+
+class AtomicOutputFile(object):
+
+    def __init__(self, writer, fname):
+
+        self.writer = writer
+        self.fname = fname
+        self.size = 0
+        self.hash = hashlib.sha1()
+
+        dname = os.path.dirname(fname)
+        tools.mkdirp(dname)
+
+        fd, self.tmp = tempfile.mkstemp(dir=dname, prefix='.tmp-')
+        self.f = os.fdopen(fd, 'wb')
+
+
+    def write(self, data):
+
+        self.f.write(data)
+        self.hash.update(data)
+        self.size += len(data)
+
+
+    def commit(self):
+        """
+        Replaces the target file with the data written, unless it already
+        had the same content.  Returns True if the file was replaced.
+        """
+        self.f.close()
+
+        if self.same_as_existing():
+            os.remove(self.tmp)
+            self.writer.unchanged += 1
+            return False
+
+        os.chmod(self.tmp, FILE_MODE)
+        os.rename(self.tmp, self.fname)
+        self.writer.changed.append((self.fname, self.size))
+
+        return True
+
+
+    def discard(self):
+
+        self.f.close()
+        os.remove(self.tmp)
+
+
+    def same_as_existing(self):
+
+        try:
+            if os.path.getsize(self.fname) != self.size:
+                return False
+
+            h = hashlib.sha1()
+            with open(self.fname, 'rb') as f:
+                for chunk in iter(lambda: f.read(65536), b''):
+                    h.update(chunk)
+
+        except (IOError, OSError):
+            return False
+
+        return h.digest() == self.hash.digest()